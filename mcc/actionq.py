@@ -0,0 +1,132 @@
+"""Run node actions in the background so command mode stays responsive.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from gevent.lock import BoundedSemaphore
+from mcc.metrics import hist_observe, counter_inc
+from mcc.providers import node_action
+from mcc.waitstate import wait_add, wait_poll
+import gevent
+import gevent.event
+import time
+
+ACTION_SLOTS = 10
+"""Maximum actions sent to providers at once, others remain queued."""
+
+PENDING = ("queued", "sending", "waiting")
+"""Status of actions not yet complete."""
+
+actions = OrderedDict()
+"""Actions by node id, as dicts of node, cmd, status, start, end & error."""
+
+action_slots = BoundedSemaphore(ACTION_SLOTS)
+
+waiting = {}
+"""Wait items of sent actions, polled together by one waiter."""
+
+wait_sched = {}
+wait_wake = gevent.event.Event()
+waiter = [None]
+
+
+def action_queue(node, cmd_name):
+    """Queue command for node and return immediately."""
+    action = {"node": node, "cmd": cmd_name, "status": "queued",
+              "start": time.time(), "sent": None, "end": None,
+              "error": None}
+    actions[node.id] = action
+    gevent.spawn(action_run, action)
+    return action
+
+
+def action_run(action):
+    """Send command to provider then hand node to the shared waiter.
+
+    The slot is only held while sending, so waiting actions don't delay
+    queued ones.
+    """
+    (node, cmd_name) = (action["node"], action["cmd"])
+    with action_slots:
+        action["status"] = "sending"
+        action["sent"] = time.time()
+        try:
+            node_action(node, cmd_name)
+        except Exception as e:
+            action_end(action, "failed", u"{0}".format(e))
+            return
+    action["status"] = "waiting"
+    wait_add(waiting, wait_sched, [node], cmd_name)
+    wait_wake.set()
+    if waiter[0] is None or waiter[0].dead:
+        waiter[0] = gevent.spawn(action_waiter)
+
+
+def action_waiter():
+    """Poll nodes of all waiting actions until none remain."""
+    while waiting:
+        try:
+            final = wait_poll(waiting, wait_sched, wait_wake)
+        except Exception as e:
+            final = dict.fromkeys(waiting, e)
+            waiting.clear()
+        for node_id, state in final.items():
+            action_done(actions.get(node_id), state)
+
+
+def action_done(action, state):
+    """Complete action with final state or exception from waiting."""
+    if action is None or action["status"] != "waiting":
+        return
+    if isinstance(state, Exception):
+        action_end(action, "failed", u"{0}".format(state))
+    else:
+        action_end(action, "timeout" if state == "timeout" else "done")
+
+
+def action_end(action, status, error=None):
+    """Record action's completion and its metrics."""
+    (node, cmd_name) = (action["node"], action["cmd"])
+    action.update(status=status, error=error, end=time.time())
+    hist_observe("mcc_action_seconds", action["end"] - action["sent"],
+                 cloud=node.cloud, action=cmd_name)
+    counter_inc("mcc_actions_total", cloud=node.cloud, action=cmd_name,
+                result="ok" if status == "done" else status)
+
+
+def action_pending(node):
+    """Return True if an action for node has not completed."""
+    action = actions.get(node.id)
+    return bool(action and action["status"] in PENDING)
+
+
+def pending_count():
+    """Return number of actions not yet complete."""
+    return sum(1 for x in actions.values() if x["status"] in PENDING)
+
+
+def actions_prune():
+    """Remove completed actions, called when node data is refreshed."""
+    for node_id in [k for k, v in actions.items() if v["status"] not in PENDING]:
+        del actions[node_id]
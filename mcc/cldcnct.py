@@ -29,76 +29,108 @@ from gevent import monkey
 import gevent
 monkey.patch_all()
 
-from libcloud.compute.types import Provider
-from libcloud.compute.providers import get_driver
-from libcloud.common.types import InvalidCredsError
-from libcloud.common.exceptions import BaseHTTPError
-from requests.exceptions import SSLError
-from mcc.confdir import CONFIG_DIR
+from mcc.providers import prov_get, prov_key
+from mcc.metrics import provider_timed
 import sys
 
+BUSY_INTERVAL = 0.25
+"""Seconds between busy display updates, limits output on slow links."""
 
-def get_conns(cred, providers):
-    """Collect node data asynchronously using gevent lib."""
-    cld_svc_map = {"aws": conn_aws,
-                   "azure": conn_az,
-                   "gcp": conn_gcp,
-                   "alicloud": conn_ali}
-    sys.stdout.write("\rEstablishing Connections:  ")
-    sys.stdout.flush()
-    busy_obj = busy_disp_on()
-    conn_fn = [[cld_svc_map[x.rstrip('1234567890')], cred[x], x]
-               for x in providers]
-    cgroup = Group()
-    conn_res = []
-    conn_res = cgroup.map(get_conn, conn_fn)
-    cgroup.join()
-    conn_objs = {}
-    for item in conn_res:
-        conn_objs.update(item)
-    busy_disp_off(dobj=busy_obj)
-    sys.stdout.write("\r                                                 \r")
-    sys.stdout.write("\033[?25h")  # cursor back on
-    sys.stdout.flush()
-    return conn_objs
+abort_opts = {"quiet": False}
+"""When quiet, abort_err raises SystemExit with its message instead of
+printing it, for callers that catch provider errors and continue."""
 
 
-def get_data(conn_objs, providers):
+def get_data(conn_objs, providers, cred, collect=None):
     """Refresh node data using existing connection-objects."""
-    cld_svc_map = {"aws": nodes_aws,
-                   "azure": nodes_az,
-                   "gcp": nodes_gcp,
-                   "alicloud": nodes_ali}
     sys.stdout.write("\rCollecting Info:  ")
     sys.stdout.flush()
     busy_obj = busy_disp_on()
-    collec_fn = [[cld_svc_map[x.rstrip('1234567890')], conn_objs[x]]
+    collec_fn = [[prov_get(prov_key(x, cred[x])).list_nodes, conn_objs[x], x]
                  for x in providers]
     ngroup = Group()
     node_list = []
-    node_list = ngroup.map(get_nodes, collec_fn)
+    node_list = ngroup.map(collect or get_nodes, collec_fn)
     ngroup.join()
     busy_disp_off(dobj=busy_obj)
-    sys.stdout.write("\r                                                 \r")
-    sys.stdout.write("\033[?25h")  # cursor back on
+    sys.stdout.write("\r\033[K\033[?25h")  # clear line, cursor back on
     sys.stdout.flush()
     return node_list
 
 
+def get_data_kept(conn_objs, providers, cred, node_list):
+    """Refresh node data, keeping node_list entries of providers that fail.
+
+    Returns (node-lists, errors) with errors as {provider: message},
+    instead of exiting on provider errors.
+    """
+    abort_opts["quiet"] = True
+    try:
+        results = get_data(conn_objs, providers, cred, get_nodes_caught)
+    finally:
+        abort_opts["quiet"] = False
+    errors = {x: res[1] for x, res in zip(providers, results) if res[1]}
+    return ([old if res[1] else res[0] for old, res in zip(node_list, results)],
+            errors)
+
+
+def get_conns_data(cred, providers):
+    """Connect to and collect nodes from providers in parallel pipelines.
+
+    Each provider's listing starts as soon as its own connection is made,
+    instead of waiting for all connections.
+    """
+    sys.stdout.write("\rConnecting & Collecting Info:  ")
+    sys.stdout.flush()
+    busy_obj = busy_disp_on()
+    chain_fn = [[prov_get(prov_key(x, cred[x])), cred[x], x]
+                for x in providers]
+    pgroup = Group()
+    conn_objs = {}
+    node_lists = {}
+    for (conn_obj, nodes) in pgroup.imap_unordered(get_chain, chain_fn):
+        conn_objs.update(conn_obj)
+        node_lists.update(dict.fromkeys(conn_obj, nodes))
+    node_list = [node_lists[x] for x in providers]
+    busy_disp_off(dobj=busy_obj)
+    sys.stdout.write("\r\033[K\033[?25h")  # clear line, cursor back on
+    sys.stdout.flush()
+    return conn_objs, node_list
+
+
+def get_chain(flist):
+    """Connect to provider then collect its nodes."""
+    conn_obj = get_conn([flist[0].connect, flist[1], flist[2]])
+    cnodes = get_nodes([flist[0].list_nodes, conn_obj[flist[2]], flist[2]])
+    return conn_obj, cnodes
+
+
 def get_conn(flist):
     """Call function for each provider."""
     cnodes = []
-    cnodes = flist[0](flist[1], flist[2])
+    with provider_timed("connect", flist[2]):
+        cnodes = flist[0](flist[1], flist[2])
     return cnodes
 
 
 def get_nodes(flist):
     """Call node collection function for each provider."""
     cnodes = []
-    cnodes = flist[0](flist[1])
+    with provider_timed("list", flist[2]):
+        cnodes = flist[0](flist[1])
     return cnodes
 
 
+def get_nodes_caught(flist):
+    """Call node collection function, returning (nodes, error-message)."""
+    try:
+        return get_nodes(flist), None
+    except SystemExit as e:
+        return None, u"{0}".format(e.code or "provider error").strip()
+    except Exception as e:
+        return None, u"{0}".format(e) or e.__class__.__name__
+
+
 def busy_disp_on():
     """Turn ON busy_display to show working statues."""
     p = gevent.spawn(busy_display)
@@ -114,193 +146,24 @@ def busy_disp_off(dobj):
 
 def busy_display():
     """Display animation to show activity."""
-    sys.stdout.write("\033[?25l")  # cursor off
-    sys.stdout.flush()
-    for x in range(1800):
+    sys.stdout.write("\033[?25l")  # cursor off, sent with first symbol
+    for x in range(int(180 / BUSY_INTERVAL)):
         symb = ['\\', '|', '/', '-']
         sys.stdout.write("\033[D{}".format(symb[x % 4]))
         sys.stdout.flush()
-        gevent.sleep(0.1)
-
-
-def ip_to_str(raw_ip):
-    """Convert IP Address list to string or null."""
-    if raw_ip:
-        return raw_ip[0]
-    else:
-        return None
-
-
-def conn_aws(cred, crid):
-    """Establish connection to AWS service."""
-    driver = get_driver(Provider.EC2)
-    try:
-        aws_obj = driver(cred['aws_access_key_id'],
-                         cred['aws_secret_access_key'],
-                         region=cred['aws_default_region'])
-    except SSLError as e:
-        abort_err("\r SSL Error with AWS: {}".format(e))
-    except InvalidCredsError as e:
-        abort_err("\r Error with AWS Credentials: {}".format(e))
-    return {crid: aws_obj}
-
-
-def nodes_aws(c_obj):
-    """Get node objects from AWS."""
-    aws_nodes = []
-    try:
-        aws_nodes = c_obj.list_nodes()
-    except BaseHTTPError as e:
-        abort_err("\r HTTP Error with AWS: {}".format(e))
-    aws_nodes = adj_nodes_aws(aws_nodes)
-    return aws_nodes
-
-
-def adj_nodes_aws(aws_nodes):
-    """Adjust details specific to AWS."""
-    for node in aws_nodes:
-        node.cloud = "aws"
-        node.cloud_disp = "AWS"
-        node.private_ips = ip_to_str(node.private_ips)
-        node.public_ips = ip_to_str(node.public_ips)
-        node.zone = node.extra['availability']
-        node.size = node.extra['instance_type']
-        node.type = node.extra['instance_lifecycle']
-    return aws_nodes
-
-
-def conn_az(cred, crid):
-    """Establish connection to Azure service."""
-    driver = get_driver(Provider.AZURE_ARM)
-    try:
-        az_obj = driver(tenant_id=cred['az_tenant_id'],
-                        subscription_id=cred['az_sub_id'],
-                        key=cred['az_app_id'],
-                        secret=cred['az_app_sec'])
-    except SSLError as e:
-        abort_err("\r SSL Error with Azure: {}".format(e))
-    except InvalidCredsError as e:
-        abort_err("\r Error with Azure Credentials: {}".format(e))
-    return {crid: az_obj}
-
-
-def nodes_az(c_obj):
-    """Get node objects from Azure."""
-    az_nodes = []
-    try:
-        az_nodes = c_obj.list_nodes()
-    except BaseHTTPError as e:
-        abort_err("\r HTTP Error with Azure: {}".format(e))
-    az_nodes = adj_nodes_az(az_nodes)
-    return az_nodes
-
-
-def adj_nodes_az(az_nodes):
-    """Adjust details specific to Azure."""
-    for node in az_nodes:
-        node.cloud = "azure"
-        node.cloud_disp = "Azure"
-        node.private_ips = ip_to_str(node.private_ips)
-        node.public_ips = ip_to_str(node.public_ips)
-        node.zone = node.extra['location']
-        node.size = node.extra['properties']['hardwareProfile']['vmSize']
-        group_raw = node.id
-        unnsc, group_end = group_raw.split("resourceGroups/", 1)
-        group, unnsc = group_end.split("/", 1)
-        node.group = group
-    return az_nodes
-
-
-def conn_gcp(cred, crid):
-    """Establish connection to GCP."""
-    gcp_auth_type = cred.get('gcp_auth_type', "S")
-    if gcp_auth_type == "A":  # Application Auth
-        gcp_crd_ia = CONFIG_DIR + ".gcp_libcloud_a_auth." + cred['gcp_proj_id']
-        gcp_crd = {'user_id': cred['gcp_client_id'],
-                   'key': cred['gcp_client_sec'],
-                   'project': cred['gcp_proj_id'],
-                   'auth_type': "IA",
-                   'credential_file': gcp_crd_ia}
-    else:  # Service Account Auth
-        gcp_pem = CONFIG_DIR + cred['gcp_pem_file']
-        gcp_crd_sa = CONFIG_DIR + ".gcp_libcloud_s_auth." + cred['gcp_proj_id']
-        gcp_crd = {'user_id': cred['gcp_svc_acct_email'],
-                   'key': gcp_pem,
-                   'project': cred['gcp_proj_id'],
-                   'credential_file': gcp_crd_sa}
-    driver = get_driver(Provider.GCE)
-    try:
-        gcp_obj = driver(**gcp_crd)
-    except SSLError as e:
-        abort_err("\r SSL Error with GCP: {}".format(e))
-    except (InvalidCredsError, ValueError) as e:
-        abort_err("\r Error with GCP Credentials: {}".format(e))
-    return {crid: gcp_obj}
-
-
-def nodes_gcp(c_obj):
-    """Get node objects from GCP."""
-    gcp_nodes = []
-    try:
-        gcp_nodes = c_obj.list_nodes(ex_use_disk_cache=True)
-    except BaseHTTPError as e:
-        abort_err("\r HTTP Error with GCP: {}".format(e))
-    gcp_nodes = adj_nodes_gcp(gcp_nodes)
-    return gcp_nodes
-
-
-def adj_nodes_gcp(gcp_nodes):
-    """Adjust details specific to GCP."""
-    for node in gcp_nodes:
-        node.cloud = "gcp"
-        node.cloud_disp = "GCP"
-        node.private_ips = ip_to_str(node.private_ips)
-        node.public_ips = ip_to_str(node.public_ips)
-        node.zone = node.extra['zone'].name
-    return gcp_nodes
-
-
-def conn_ali(cred, crid):
-    """Establish connection to AliCloud service."""
-    driver = get_driver(Provider.ALIYUN_ECS)
-    try:
-        ali_obj = driver(cred['ali_access_key_id'],
-                         cred['ali_access_key_secret'],
-                         region=cred['ali_region'])
-    except SSLError as e:
-        abort_err("\r SSL Error with AliCloud: {}".format(e))
-    except InvalidCredsError as e:
-        abort_err("\r Error with AliCloud Credentials: {}".format(e))
-    return {crid: ali_obj}
-
-
-def nodes_ali(c_obj):
-    """Get node objects from AliCloud."""
-    ali_nodes = []
-    try:
-        ali_nodes = c_obj.list_nodes()
-    except BaseHTTPError as e:
-        abort_err("\r HTTP Error with AliCloud: {}".format(e))
-    ali_nodes = adj_nodes_ali(ali_nodes)
-    return ali_nodes
-
-
-def adj_nodes_ali(ali_nodes):
-    """Adjust details specific to AliCloud."""
-    for node in ali_nodes:
-        node.cloud = "alicloud"
-        node.cloud_disp = "AliCloud"
-        node.private_ips = ip_to_str(node.extra['vpc_attributes']['private_ip_address'])
-        node.public_ips = ip_to_str(node.public_ips)
-        node.zone = node.extra['zone_id']
-        node.size = node.extra['instance_type']
-        if node.size.startswith('ecs.'):
-            node.size = node.size[len('ecs.'):]
-    return ali_nodes
+        gevent.sleep(BUSY_INTERVAL)
 
 
 def abort_err(messg):
-    """Print Error Message and Exit."""
-    print(messg)
-    print("\033[?25h")
-    sys.exit()
+    """Print Error Message and Exit.
+
+    The SystemExit raised holds the error being handled as orig_err, as
+    py2 exceptions have no __context__.
+    """
+    exc = SystemExit(messg)
+    if not abort_opts["quiet"]:
+        print(messg)
+        print("\033[?25h")
+        exc = SystemExit()
+    exc.orig_err = sys.exc_info()[1]
+    raise exc
@@ -63,7 +63,7 @@ C_STAT = {"running": C_GOOD, "starting": C_GOOD, "rebooting": C_WARN,
           "stopping": C_WARN, "stopped": C_NORM, "error": C_ERR,
           "updating": C_WARN, "unknown": C_WARN, "reconfiguring": C_WARN,
           "terminated": C_NORM, "RUN": C_GOOD, "STOP": C_ERR, "CONNECT": C_TI,
-          "DETAILS": C_TI}
+          "DETAILS": C_TI, "EXEC": C_TI}
 """Color dictionary for instance status colors.
 
 Any value encountered in the AWS data must be listed or a KeyError is
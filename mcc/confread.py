@@ -0,0 +1,230 @@
+"""Read, validate and cache configuration from config files.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+import configparser
+from collections import OrderedDict
+from mcc.confdir import CONFIG_DIR
+from mcc.colors import C_NORM, C_ERR, C_WARN
+from mcc.providers import prov_get, prov_key, prov_supported
+import json
+import os
+import sys
+
+CACHE_FILE = u"{0}.config_cache.json".format(CONFIG_DIR)
+"""Validated configuration from the last read, keyed by file mtimes."""
+
+CACHE_VERSION = 2
+
+INFO_KEYS = ["providers", "cache_backend", "cache_path", "cache_url",
+             "cache_ttl", "normalize_workers", "normalize_chunk"]
+"""Entries allowed in the [info] section."""
+
+INFO_CHOICES = {"cache_backend": ["none", "sqlite", "redis"]}
+INFO_INTS = ["cache_ttl", "normalize_workers", "normalize_chunk"]
+
+COMMON_KEYS = ["provider", "cache_ttl"]
+"""Entries allowed in every provider section."""
+
+
+def config_files(profile=None, extra_files=None):
+    """Return list of config files to read, later files take precedence.
+
+    The base config.ini is followed by config.<profile>.ini if a profile
+    is specified, then any additional files.
+    """
+    config_file = (u"{0}config.ini".format(CONFIG_DIR))
+    if not os.path.isfile(config_file):
+        config_make(config_file)
+    files = [config_file]
+    if profile:
+        files.append(u"{0}config.{1}.ini".format(CONFIG_DIR, profile))
+    files.extend(extra_files or [])
+    missing = [x for x in files if not os.path.isfile(x)]
+    if missing:
+        print("Config file not found: {}".format(", ".join(missing)))
+        sys.exit()
+    return files
+
+
+def config_read(profile=None, extra_files=None):
+    """Read config info, using the cached result if files are unchanged."""
+    files = config_files(profile, extra_files)
+    cache_key = [CACHE_VERSION] + [[x, os.path.getmtime(x),
+                                    os.path.getsize(x)] for x in files]
+    cached = cache_load(cache_key)
+    if cached:
+        (cred, providers, info, warnings) = cached
+    else:
+        (cred, providers, info, warnings, errors) = config_parse(files)
+        if errors:
+            config_errors(warnings, errors)
+        cache_save(cache_key, cred, providers, info, warnings)
+    for warning in warnings:
+        print("{0}{1}{2}".format(C_WARN, warning, C_NORM))
+    return cred, providers, info
+
+
+def config_parse(files):
+    """Parse and validate config files."""
+    config = configparser.ConfigParser(allow_no_value=True)
+    try:
+        config.read(files, encoding='utf-8')
+    except (IOError, configparser.Error) as e:
+        print("Error reading config file: {}".format(e))
+        sys.exit()
+    # De-duplicate provider-list
+    providers = config_prov(config)
+    (info, errors) = config_info(config)
+    # Read and validate credentials for listed providers
+    (cred, warnings, cred_errors) = config_cred(config, providers)
+    errors.extend(cred_errors)
+    # remove unsupported and credential-less providers
+    providers = [x for x in providers if x in cred]
+    return cred, providers, info, warnings, errors
+
+
+def config_prov(config):
+    """Read providers from configfile and de-duplicate it."""
+    try:
+        providers = [e.strip() for e in (config['info']
+                                         ['providers']).split(',')]
+    except KeyError as e:
+        print("Error reading config item: {}".format(e))
+        sys.exit()
+    providers = list(OrderedDict.fromkeys(x for x in providers if x))
+    return providers
+
+
+def config_info(config):
+    """Read and validate settings from the [info] section."""
+    info = dict(config['info'].items())
+    errors = ["[info] unknown entry '{0}'".format(x) for x in info
+              if x not in INFO_KEYS]
+    for key, choices in INFO_CHOICES.items():
+        if info.get(key, choices[0]) not in choices:
+            errors.append("[info] {0} must be one of: {1}".
+                          format(key, ", ".join(choices)))
+    errors.extend(int_check("info", info, INFO_INTS))
+    return info, errors
+
+
+def int_check(section_name, section, keys):
+    """Return errors for entries in keys that are not integers."""
+    errors = []
+    for key in keys:
+        try:
+            int(section.get(key, 0))
+        except ValueError:
+            errors.append("[{0}] {1} must be a whole number".
+                          format(section_name, key))
+    return errors
+
+
+def config_cred(config, providers):
+    """Read credentials from configfile and validate against providers."""
+    cred = {}
+    warnings = []
+    errors = []
+    for item in providers:
+        if item not in config:
+            warnings.append("No credentials section in config file for '{}'"
+                            " - provider will be skipped.".format(item))
+            continue
+        section = dict(list(config[item].items()))
+        prov_name = prov_key(item, section)
+        if not prov_supported(prov_name):
+            warnings.append("Unsupported provider: '{}' listed in config -"
+                            " ignoring".format(item))
+            continue
+        item_errors = cred_validate(prov_name, section)
+        errors.extend("[{0}] {1}".format(item, x) for x in item_errors)
+        errors.extend(int_check(item, section, ["cache_ttl"]))
+        cred[item] = section
+    return cred, warnings, errors
+
+
+def cred_validate(prov_name, section):
+    """Return list of errors in a provider section."""
+    try:
+        (required, optional) = prov_get(prov_name).cred_keys(section)
+    except ValueError as e:
+        return [str(e)]
+    errors = [("empty entry '{0}'" if x in section else
+               "missing entry '{0}'").format(x)
+              for x in required if not section.get(x)]
+    allowed = set(required) | set(optional) | set(COMMON_KEYS)
+    errors.extend("unknown entry '{0}'".format(x) for x in section
+                  if x not in allowed)
+    return errors
+
+
+def config_errors(warnings, errors):
+    """Print all config problems and exit."""
+    for warning in warnings:
+        print("{0}{1}{2}".format(C_WARN, warning, C_NORM))
+    print("{0}Errors in config file:{1}".format(C_ERR, C_NORM))
+    for error in errors:
+        print("  {}".format(error))
+    sys.exit()
+
+
+def cache_load(cache_key):
+    """Return cached (cred, providers, info, warnings) if key matches."""
+    try:
+        with open(CACHE_FILE) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if cached.get("key") != cache_key:
+        return None
+    return (cached["cred"], cached["providers"], cached["info"],
+            cached["warnings"])
+
+
+def cache_save(cache_key, cred, providers, info, warnings):
+    """Save validated config, readable only by owner as it has secrets."""
+    try:
+        fd = os.open(CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"key": cache_key, "cred": cred, "providers": providers,
+                       "info": info, "warnings": warnings}, f)
+    except (IOError, OSError):
+        pass
+
+
+def config_make(config_file):
+    """Create config.ini on first use, make dir and copy sample."""
+    from pkg_resources import resource_filename
+    import shutil
+    if not os.path.exists(CONFIG_DIR):
+        os.makedirs(CONFIG_DIR)
+    filename = resource_filename("mcc", "config.ini")
+    try:
+        shutil.copyfile(filename, config_file)
+    except IOError:
+        print("Error copying sample config file: {}".format(config_file))
+        sys.exit()
+    print("Please add credential information to {}".format(config_file))
+    sys.exit()
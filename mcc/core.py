@@ -23,38 +23,317 @@ Author:    Robert Peteuil
 
 """
 from __future__ import absolute_import, print_function
-import configparser
+import argparse
+import gevent
+import signal
 from collections import OrderedDict
-from mcc.confdir import CONFIG_DIR
+from datetime import datetime
+from mcc.confread import config_read, config_files
 import mcc.tables as table
 import mcc.cldcnct as cld
+from mcc.providers import norm_setup
 import mcc.uimode as ui
-import os
-import sys
-
+import mcc.sshexec as sshexec
+import mcc.nodeidx as nodeidx
+import mcc.rollup as rollup
+import mcc.history as history
+import mcc.nodecache as nodecache
+import mcc.metrics as metrics
+import mcc.actionq as actionq
+import mcc.watch as watch
+import mcc.policy as policy
 __version__ = "0.9.8"
 
 
 def main():
     """Command-Mode: Retrieve and display data then process commands."""
-    (cred, providers) = config_read()
+    args = get_args("mcc")
+    if args.command == "apply-policies":
+        policy_only(args)
+        return
+    ui.view_opts["query"] = args.query
+    (cred, providers, info) = get_config(args)
+    if args.metrics_port:
+        metrics.metrics_serve(args.metrics_port)
+    store = nodecache.cache_open(info)
     cmd_mode = True
-    conn_objs = cld.get_conns(cred, providers)
+    (conn_objs, nodes) = cld.get_conns_data(cred, providers)
     while cmd_mode:
-        nodes = cld.get_data(conn_objs, providers)
-        node_dict = make_node_dict(nodes, "name")
-        idx_tbl = table.indx_table(node_dict, True)
-        cmd_mode = ui.ui_main(idx_tbl, node_dict)
+        if cmd_mode is True:
+            if store:
+                nodecache.cache_store(store, cred, providers, nodes)
+            actionq.actions_prune()
+            node_dict = make_node_dict(nodes, "name")
+            metrics.fleet_record(node_dict)
+            sshexec.profiles_build(node_dict, persist=args.simulate is None)
+            if args.simulate is None:
+                history.history_record(providers, nodes)
+            index = nodeidx.index_build(node_dict)
+        view_dict = nodeidx.dict_filter(node_dict, nodeidx.index_query(
+            index, ui.view_opts["query"]))
+        idx_tbl = table.indx_table(view_dict, True)
+        cmd_mode = ui.ui_main(idx_tbl, view_dict)
+        if cmd_mode is True:
+            nodes = cld.get_data(conn_objs, providers, cred)
     print("\033[?25h")
 
 
 def list_only():
     """List-Mode: Retrieve and display data then exit."""
-    (cred, providers) = config_read()
-    conn_objs = cld.get_conns(cred, providers)
-    nodes = cld.get_data(conn_objs, providers)
+    args = get_args("mccl")
+    if args.catalog_import:
+        rollup.catalog_import(args.catalog_import)
+        return
+    if args.diff or args.history:
+        history_only(args)
+        return
+    (cred, providers, info) = get_config(args)
+    store = nodecache.cache_open(info)
+    if args.cache_stats:
+        nodecache.cache_stats(store)
+        return
+    if args.metrics_file:
+        metrics.metrics_file_on_exit(args.metrics_file)
+    if args.watch:
+        watch_only(args, cred, providers, store)
+        return
+    list_show(args, list_collect(args, cred, providers, info, store))
+
+
+def list_collect(args, cred, providers, info, store):
+    """Return node_dict from cache or providers, recording fresh sections."""
+    if store:
+        (nodes, fresh) = nodecache.cached_collect(store, cred, providers, info)
+    else:
+        (conn_objs, nodes) = cld.get_conns_data(cred, providers)
+        fresh = providers
+    node_dict = make_node_dict(nodes, "name")
+    metrics.fleet_record(node_dict)
+    # history only, cached_collect has stored the fresh sections
+    fresh_record(args, None, cred, [x for x in zip(providers, nodes)
+                                    if x[0] in fresh])
+    return node_dict
+
+
+def list_show(args, node_dict):
+    """Display nodes matching --query as a table, rollup or groups."""
+    index = nodeidx.index_build(node_dict)
+    nums = nodeidx.index_query(index, args.query)
+    if args.rollup:
+        keys = [x.strip() for x in args.rollup.split(",") if x.strip()]
+        rollups = rollup.rollup_calc(node_dict, nums, keys)
+        table.rollup_table(rollups, rollup.ROLLUP_COLS)
+    elif args.group_by:
+        groups = nodeidx.index_group(index, node_dict, nums, args.group_by)
+        table.group_table(groups, args.group_by)
+    else:
+        table.indx_table(nodeidx.dict_filter(node_dict, nums))
+
+
+def policy_only(args):
+    """Policy-Mode: Plan actions bringing nodes to policy state, run them.
+
+    Plans from cached nodes (--cached) or for another time (--at) are
+    displayed without running them.
+    """
+    if args.simulate is None:
+        policies = policy.policies_read(config_files(args.profile, args.config))
+    else:
+        policies = policy.policies_read(args.config or [])
+    if not policies:
+        print("No policies defined, add them to {0}".format(policy.POLICY_FILE))
+        return
+    node_dict = policy_nodes(args)
+    now = datetime.fromtimestamp(history.time_parse(args.at or "0s"))
+    plan = policy.plan_make(policies, node_dict, now, args.query)
+    if not plan:
+        print("No actions required, {0} policies applied to {1} nodes".format(
+            len(policies), len(node_dict)))
+        return
+    plan_apply(args, plan)
+
+
+def plan_apply(args, plan):
+    """Display plan, then run it unless only displaying."""
+    table.plan_table(plan)
+    if args.dry_run or args.cached or args.at:
+        return
+    print("\nRunning {0} actions".format(len(plan)))
+    results = policy.plan_run(plan)
+    table.plan_table(plan, results)
+
+
+def policy_nodes(args):
+    """Return node_dict of nodes policies are applied to."""
+    (cred, providers, info) = get_config(args)
+    if args.cached:
+        return make_node_dict(policy.cached_nodes(cred, providers, info),
+                              "name")
+    (conn_objs, nodes) = cld.get_conns_data(cred, providers)
     node_dict = make_node_dict(nodes, "name")
-    table.indx_table(node_dict)
+    if args.simulate is None:
+        history.history_record(providers, nodes)
+    return node_dict
+
+
+def watch_only(args, cred, providers, store):
+    """Watch-Mode: Refresh on an interval, redrawing rows that changed.
+
+    Connections are made once and re-used for every refresh.  Providers
+    that fail to refresh keep their earlier nodes and are retried at the
+    next refresh.
+    """
+    (conn_objs, nodes) = cld.get_conns_data(cred, providers)
+    (seen, errors) = ({}, {})
+    # deliver Ctrl-C to this loop instead of the gevent hub, gevent < 1.5
+    # names signal_handler 'signal'
+    handler = getattr(gevent, "signal_handler", None) or gevent.signal
+    handler(signal.SIGINT, gevent.kill, gevent.getcurrent(), KeyboardInterrupt)
+    try:
+        while True:
+            fresh_record(args, store, cred, [x for x in zip(providers, nodes)
+                                             if x[0] not in errors])
+            node_dict = make_node_dict(nodes, "name")
+            metrics.fleet_record(node_dict)
+            if args.metrics_file:
+                metrics.metrics_write(args.metrics_file)
+            index = nodeidx.index_build(node_dict)
+            view_dict = nodeidx.dict_filter(node_dict, nodeidx.index_query(
+                index, args.query))
+            watch.watch_draw(view_dict, seen, args.watch, errors)
+            watch.watch_sleep(args.watch)
+            (nodes, errors) = cld.get_data_kept(conn_objs, providers, cred,
+                                                nodes)
+    except KeyboardInterrupt:
+        print("\r\033[K\033[?25h", end="")  # clear busy display, cursor on
+
+
+def fresh_record(args, store, cred, sections):
+    """Store nodes collected in cache and history, sections as [(crid, nodes)]."""
+    providers = [x[0] for x in sections]
+    nodes = [x[1] for x in sections]
+    if store:
+        nodecache.cache_store(store, cred, providers, nodes)
+    if args.simulate is None:
+        history.history_record(providers, nodes)
+
+
+def history_only(args):
+    """History-Mode: Display recorded changes without collecting data."""
+    if args.diff:
+        rows = history.history_diff(args.diff)
+    else:
+        rows = history.history_node(args.history)
+    if rows:
+        table.history_table(rows)
+    else:
+        print("No changes recorded")
+
+
+def get_config(args):
+    """Read config files or --simulate settings, apply [info] options."""
+    if args.simulate is not None:
+        from mcc.providers.sim import sim_config
+        (cred, providers, info) = sim_config(args.simulate)
+    else:
+        (cred, providers, info) = config_read(args.profile, args.config)
+    norm_setup(info)
+    return cred, providers, info
+
+
+def get_args(prog):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Command-Line Instance Control for AWS,"
+        " Azure, GCP and AliCloud.")
+    parser.add_argument("-q", "--query", default="",
+                        help="only include nodes matching all terms, e.g."
+                        " 'env=prod state=running'. Terms are key=value,"
+                        " key!=value or key (tag exists). Keys are cloud,"
+                        " zone, size, state, group, name or a tag-name."
+                        " Values may include wildcards")
+    parser.add_argument("-p", "--profile",
+                        help="read config.PROFILE.ini from the config dir"
+                        " after config.ini, overriding its entries")
+    parser.add_argument("-c", "--config", metavar="FILE", action="append",
+                        help="read additional config FILE, overriding"
+                        " earlier files (may be used more than once)")
+    if prog == "mccl":
+        parser.add_argument("-g", "--group-by", metavar="KEY",
+                            help="summarize node count and sizes per value"
+                            " of KEY (a field or tag-name)")
+        parser.add_argument("-r", "--rollup", metavar="KEYS",
+                            help="display count, capacity and estimated"
+                            " hourly cost per value of each comma"
+                            " separated KEY, e.g. 'cloud,region,size,team'")
+        parser.add_argument("--catalog-import", metavar="FILE",
+                            help="merge sizes & prices from JSON or CSV"
+                            " FILE into the local catalog and exit")
+        parser.add_argument("--cache-stats", action="store_true",
+                            help="display shared cache hit/miss counts and"
+                            " exit")
+        parser.add_argument("--diff", metavar="TIME",
+                            help="display node changes recorded since TIME"
+                            " (30m, 12h, 2d, 'YYYY-MM-DD HH:MM' or epoch)"
+                            " and exit")
+        parser.add_argument("--history", metavar="NODE",
+                            help="display changes recorded for node name"
+                            " or id and exit")
+        parser.add_argument("--metrics-file", metavar="FILE",
+                            help="write collection metrics to FILE in"
+                            " Prometheus text format on exit (and after"
+                            " each refresh with --watch), for the"
+                            " node_exporter textfile collector")
+        parser.add_argument("-w", "--watch", metavar="SECONDS",
+                            type=interval_arg,
+                            help="keep running, refreshing every SECONDS"
+                            " and redrawing rows that changed. Recent state"
+                            " changes are marked beside their rows")
+    else:
+        parser.add_argument("command", nargs="?", choices=["apply-policies"],
+                            help="apply-policies: start and stop nodes as"
+                            " required by the power policies in"
+                            " policies.ini or 'policy:NAME' config sections,"
+                            " then exit")
+        parser.add_argument("-n", "--dry-run", action="store_true",
+                            help="with apply-policies, display planned"
+                            " actions without running them")
+        parser.add_argument("--cached", action="store_true",
+                            help="with apply-policies, plan from the shared"
+                            " cache (or the last recorded collection)"
+                            " instead of collecting, implies --dry-run")
+        parser.add_argument("--at", metavar="TIME",
+                            help="with apply-policies, plan for TIME"
+                            " ('YYYY-MM-DD HH:MM') instead of now, implies"
+                            " --dry-run")
+        parser.add_argument("--metrics-port", metavar="[ADDR:]PORT",
+                            help="serve collection and action metrics for"
+                            " Prometheus at http://ADDR:PORT/metrics"
+                            " (ADDR defaults to 127.0.0.1)")
+    parser.add_argument("--simulate", metavar="SETTINGS", nargs="?", const="",
+                        help="use a simulated fleet on all four clouds"
+                        " instead of configured providers, for offline load"
+                        " testing. SETTINGS are comma separated nodes (total,"
+                        " default 1000), latency (seconds per request),"
+                        " page_size, throttle (fraction of requests rate"
+                        " limited), transition (seconds per start or stop),"
+                        " churn (fraction of nodes changing state per"
+                        " refresh) and seed, e.g. 'nodes=100000,throttle=0.01'."
+                        " History and ssh profiles are not recorded")
+    parser.add_argument("-v", "--version", action="version",
+                        version="%(prog)s {0}".format(__version__))
+    return parser.parse_args()
+
+
+def interval_arg(value):
+    """Convert refresh interval argument to a positive number of seconds."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError("invalid interval: '{0}'".format(value))
+    return seconds
 
 
 def make_node_dict(outer_list, sort="zone"):
@@ -79,74 +358,5 @@ def make_node_dict(outer_list, sort="zone"):
     return node_dict
 
 
-def config_read():
-    """Read config info from config file."""
-    config_file = (u"{0}config.ini".format(CONFIG_DIR))
-    if not os.path.isfile(config_file):
-        config_make(config_file)
-    config = configparser.ConfigParser(allow_no_value=True)
-    try:
-        config.read(config_file, encoding='utf-8')
-    except IOError:
-        print("Error reading config file: {}".format(config_file))
-        sys.exit()
-    # De-duplicate provider-list
-    providers = config_prov(config)
-    # Read credentials for listed providers
-    (cred, to_remove) = config_cred(config, providers)
-    # remove unsupported and credential-less providers
-    for item in to_remove:
-        providers.remove(item)
-    return cred, providers
-
-
-def config_prov(config):
-    """Read providers from configfile and de-duplicate it."""
-    try:
-        providers = [e.strip() for e in (config['info']
-                                         ['providers']).split(',')]
-    except KeyError as e:
-        print("Error reading config item: {}".format(e))
-        sys.exit()
-    providers = list(OrderedDict.fromkeys(providers))
-    return providers
-
-
-def config_cred(config, providers):
-    """Read credentials from configfile."""
-    expected = ['aws', 'azure', 'gcp', 'alicloud']
-    cred = {}
-    to_remove = []
-    for item in providers:
-        if any(item.startswith(itemb) for itemb in expected):
-            try:
-                cred[item] = dict(list(config[item].items()))
-            except KeyError as e:
-                print("No credentials section in config file for {} -"
-                      " provider will be skipped.".format(e))
-                to_remove.append(item)
-        else:
-            print("Unsupported provider: '{}' listed in config - ignoring"
-                  .format(item))
-            to_remove.append(item)
-    return cred, to_remove
-
-
-def config_make(config_file):
-    """Create config.ini on first use, make dir and copy sample."""
-    from pkg_resources import resource_filename
-    import shutil
-    if not os.path.exists(CONFIG_DIR):
-        os.makedirs(CONFIG_DIR)
-    filename = resource_filename("mcc", "config.ini")
-    try:
-        shutil.copyfile(filename, config_file)
-    except IOError:
-        print("Error copying sample config file: {}".format(config_file))
-        sys.exit()
-    print("Please add credential information to {}".format(config_file))
-    sys.exit()
-
-
 if __name__ == '__main__':
     main()
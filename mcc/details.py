@@ -0,0 +1,70 @@
+"""Fetch extended node details on demand and cache them per node.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from gevent.pool import Group
+from mcc.providers import node_prov
+
+details_cache = {}
+"""Details by (cloud, node-id), stored with the node state they were
+fetched in.  Entries are used until the node's state changes."""
+
+
+def details_get(node):
+    """Return (sections, cached) for node.
+
+    Sections are {title: [(label, value), ..]}.  Sections the provider
+    returns as functions require API calls, they're called concurrently.
+    """
+    key = (node.cloud, node.id)
+    cached = details_cache.get(key)
+    if cached and cached[0] == node.state:
+        return cached[1], True
+    sections = node_prov(node).details(node)
+    if details_fetch(node, sections):
+        details_cache[key] = (node.state, sections)
+    return sections, False
+
+
+def details_fetch(node, sections):
+    """Replace sections given as functions with the rows they return.
+
+    Functions are called concurrently, returns True if all succeed.
+    """
+    fetch = [x for x, v in sections.items() if callable(v)]
+    if node.driver is None:  # node from shared cache, no connection
+        results = [([("-", "not available for cached node")], False)] * len(fetch)
+    else:
+        results = Group().map(lambda x: details_call(sections[x]), fetch)
+    for title, (rows, unused) in zip(fetch, results):
+        sections[title] = rows
+    return all(x[1] for x in results)
+
+
+def details_call(fetch_fn):
+    """Call fetch function, return (rows, success)."""
+    try:
+        return fetch_fn(), True
+    except Exception as e:
+        return [("error", u"{0}".format(e))], False
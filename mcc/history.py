@@ -0,0 +1,224 @@
+"""Record node changes between collections and query node history.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from datetime import datetime
+from mcc.confdir import CONFIG_DIR
+import re
+import sqlite3
+import sys
+import time
+
+HISTORY_FILE = u"{0}history.db".format(CONFIG_DIR)
+"""Append-only store of node changes.
+
+Only the first snapshot stores every node, later snapshots store the
+nodes added, removed or changed since the previous one.  The current
+table holds the latest state of each node to compare against, with the
+config section it was collected from, so collections of some sections
+only compare nodes of those sections.
+"""
+
+HIST_FIELDS = ("name", "cloud", "zone", "size", "state", "public_ips",
+               "private_ips")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY,"
+    " ts REAL NOT NULL, nodes INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS current (node_key TEXT PRIMARY KEY, {0},"
+    " section TEXT)".format(", ".join("{0} TEXT".format(x)
+                                      for x in HIST_FIELDS)),
+    "CREATE TABLE IF NOT EXISTS changes (snap_id INTEGER NOT NULL,"
+    " ts REAL NOT NULL, node_key TEXT NOT NULL, name TEXT, cloud TEXT,"
+    " change TEXT NOT NULL, field TEXT, old TEXT, new TEXT, node_id TEXT)"]
+
+UPGRADES = [("changes", "node_id", "UPDATE changes SET node_id ="
+             " substr(node_key, instr(node_key, ':') + 1)"),
+            ("current", "section", None)]
+"""Columns added since tables were first created, with their fill query.
+
+Nodes in current without a section are compared when their cloud is
+collected, until they are recorded again.
+"""
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS changes_ts ON changes (ts)",
+    "CREATE INDEX IF NOT EXISTS changes_name ON changes (name)",
+    "CREATE INDEX IF NOT EXISTS changes_key ON changes (node_key)",
+    "CREATE INDEX IF NOT EXISTS changes_id ON changes (node_id)"]
+
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def history_open():
+    """Open history database, creating tables if required."""
+    conn = sqlite3.connect(HISTORY_FILE, timeout=30)
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    schema_upgrade(conn)
+    for stmt in INDEXES:
+        conn.execute(stmt)
+    return conn
+
+
+def schema_upgrade(conn):
+    """Add columns missing from databases created by earlier versions."""
+    for (table, column, fill) in UPGRADES:
+        columns = [x[1] for x in conn.execute("PRAGMA table_info({0})".
+                                              format(table))]
+        if column not in columns:
+            with conn:
+                conn.execute("ALTER TABLE {0} ADD COLUMN {1} TEXT".
+                             format(table, column))
+                if fill:
+                    conn.execute(fill)
+
+
+def node_record(node, section):
+    """Return node key and tuple of tracked field values then section."""
+    values = [str_or_none(getattr(node, x, None)) for x in HIST_FIELDS]
+    return ("{0}:{1}".format(node.cloud, node.id), tuple(values + [section]))
+
+
+def str_or_none(value):
+    """Convert value to text, leaving None unchanged."""
+    return None if value is None else u"{0}".format(value)
+
+
+def history_record(providers, node_list):
+    """Store changes between nodes collected and the previous snapshot.
+
+    node_list holds a list of nodes for each provider section collected,
+    nodes of other sections are left unchanged.
+    """
+    if not providers:
+        return
+    ts = time.time()
+    new = dict(node_record(node, crid)
+               for crid, nodes in zip(providers, node_list) for node in nodes)
+    try:
+        conn = history_open()
+        with conn:
+            old = current_read(conn, providers,
+                               set(x[1] for x in new.values()))
+            snap_id = conn.execute(
+                "INSERT INTO snapshots (ts, nodes) VALUES (?, ?)",
+                (ts, len(new))).lastrowid
+            changes = list(changes_calc(old, new, snap_id, ts))
+            conn.executemany("INSERT INTO changes VALUES"
+                             " (?,?,?,?,?,?,?,?,?,?)", changes)
+            current_update(conn, old, new)
+        conn.close()
+    except sqlite3.Error as e:
+        print("Error recording history in {0}: {1}".format(HISTORY_FILE, e))
+
+
+def changes_calc(old, new, snap_id, ts):
+    """Generate change rows for nodes added, removed or changed."""
+    for key in set(old) | set(new):
+        (before, after) = (old.get(key), new.get(key))
+        if before == after:
+            continue
+        (name, cloud) = (after or before)[0:2]
+        base = (snap_id, ts, key, name, cloud)
+        node_id = key.split(":", 1)[1]
+        if before is None:
+            yield base + ("added", "state", None, after[4], node_id)
+        elif after is None:
+            yield base + ("removed", "state", before[4], None, node_id)
+        else:
+            for i, field in enumerate(HIST_FIELDS):
+                if before[i] != after[i]:
+                    yield base + ("changed", field, before[i], after[i],
+                                  node_id)
+
+
+def current_read(conn, providers, clouds):
+    """Return {node-key: record} of current nodes in providers sections."""
+    return {row[0]: tuple(row[1:]) for row in
+            conn.execute("SELECT * FROM current")
+            if row[-1] in providers or (row[-1] is None and row[2] in clouds)}
+
+
+def current_update(conn, old, new):
+    """Update the current table to match new."""
+    conn.executemany("DELETE FROM current WHERE node_key = ?",
+                     [(key,) for key in set(old) - set(new)])
+    conn.executemany("INSERT OR REPLACE INTO current VALUES ({0})".
+                     format(",".join("?" * (len(HIST_FIELDS) + 2))),
+                     [(key,) + rec for key, rec in new.items()
+                      if old.get(key) != rec])
+
+
+def history_diff(since):
+    """Return changes recorded since time, oldest first."""
+    return history_query("SELECT ts, name, cloud, change, field, old, new"
+                         " FROM changes WHERE ts >= ? ORDER BY ts",
+                         (time_parse(since),))
+
+
+def history_node(node_name):
+    """Return all changes recorded for node name or id, oldest first."""
+    return history_query("SELECT ts, name, cloud, change, field, old, new"
+                         " FROM changes WHERE node_key IN (SELECT node_key"
+                         " FROM changes WHERE name = ? OR node_id = ?)"
+                         " ORDER BY ts", (node_name, node_name))
+
+
+def history_current():
+    """Return latest recorded fields of each node as dicts, including id."""
+    rows = history_query("SELECT * FROM current", ())
+    return [dict(zip(HIST_FIELDS, row[1:]), id=row[0].split(":", 1)[1])
+            for row in rows]
+
+
+def history_query(query, params):
+    """Run query against history database and return rows."""
+    try:
+        conn = history_open()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+    except sqlite3.Error as e:
+        print("Error reading history from {0}: {1}".format(HISTORY_FILE, e))
+        sys.exit()
+    return rows
+
+
+def time_parse(time_str):
+    """Convert relative time (30m, 12h, 2d), date-time or epoch to epoch."""
+    match = re.match(r"^(\d+(?:\.\d+)?)([smhdw])$", time_str.strip())
+    if match:
+        return time.time() - float(match.group(1)) * TIME_UNITS[match.group(2)]
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S",
+                "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.strptime(time_str, fmt).timetuple())
+        except ValueError:
+            pass
+    try:
+        return float(time_str)
+    except ValueError:
+        print("Invalid time: '{0}' - use 30m, 12h, 2d, 'YYYY-MM-DD HH:MM'"
+              " or epoch seconds".format(time_str))
+        sys.exit()
@@ -0,0 +1,215 @@
+"""Record collection and action metrics and export them for Prometheus.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from contextlib import contextmanager
+import atexit
+import os
+import sys
+import time
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+"""Histogram bucket upper bounds in seconds."""
+
+METRIC_DEFS = {
+    "mcc_connect_seconds": ("histogram", "Time to connect to provider"),
+    "mcc_list_seconds": ("histogram", "Time to list nodes from provider"),
+    "mcc_provider_errors_total": ("counter", "Provider calls failed, kind"
+                                  " is throttle or error"),
+    "mcc_nodes": ("gauge", "Nodes in the last collection"),
+    "mcc_last_collect_timestamp_seconds": ("gauge", "Time of the last"
+                                           " collection"),
+    "mcc_action_seconds": ("histogram", "Time to complete node actions"),
+    "mcc_actions_total": ("counter", "Node actions by result"),
+    "mcc_tty_writes_total": ("counter", "Terminal writes in command mode"),
+    "mcc_tty_bytes_total": ("counter", "Bytes written to terminal in"
+                            " command mode")}
+
+THROTTLE_TEXT = ("throttl", "rate limit", "ratelimit", "requestlimitexceeded",
+                 "too many requests")
+"""Error message fragments identifying rate limiting responses."""
+
+metric_data = {}
+"""Values by metric name, then by sorted tuple of label pairs."""
+
+
+def label_key(labels):
+    """Convert label dict to hashable key."""
+    return tuple(sorted(labels.items()))
+
+
+def counter_inc(name, amount=1, **labels):
+    """Increase counter."""
+    values = metric_data.setdefault(name, {})
+    key = label_key(labels)
+    values[key] = values.get(key, 0) + amount
+
+
+def gauge_set(name, value, **labels):
+    """Set gauge to value."""
+    metric_data.setdefault(name, {})[label_key(labels)] = value
+
+
+def hist_observe(name, value, **labels):
+    """Add observation to histogram."""
+    values = metric_data.setdefault(name, {})
+    hist = values.setdefault(label_key(labels), [0] * (len(BUCKETS) + 2))
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            hist[i] += 1
+    hist[-2] += value
+    hist[-1] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe time taken by the enclosed block, even if it fails."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        hist_observe(name, time.time() - start, **labels)
+
+
+@contextmanager
+def provider_timed(stage, provider):
+    """Time a provider call and count its errors.
+
+    Providers report errors with abort_err, which exits.  The original
+    error it holds is checked to detect throttling.
+    """
+    with timed("mcc_{0}_seconds".format(stage), provider=provider):
+        try:
+            yield
+        except (Exception, SystemExit) as e:
+            counter_inc("mcc_provider_errors_total", provider=provider,
+                        stage=stage, kind=error_kind(e))
+            raise
+
+
+def error_kind(err):
+    """Return 'throttle' if err or its cause is a rate limit response."""
+    while err is not None:
+        code = getattr(err, "code", None)
+        text = u"{0}".format(err).lower()
+        if code == 429 or any(x in text for x in THROTTLE_TEXT):
+            return "throttle"
+        err = getattr(err, "orig_err", None) or getattr(err, "__context__", None)
+    return "error"
+
+
+def fleet_record(node_dict):
+    """Set node count gauges per cloud and state."""
+    counts = {}
+    for node in node_dict.values():
+        key = (node.cloud, node.state)
+        counts[key] = counts.get(key, 0) + 1
+    metric_data["mcc_nodes"] = {}
+    for (cloud, state), count in counts.items():
+        gauge_set("mcc_nodes", count, cloud=cloud, state=state)
+    gauge_set("mcc_last_collect_timestamp_seconds", time.time())
+
+
+def metrics_text():
+    """Return metrics in Prometheus text exposition format."""
+    lines = []
+    for name in sorted(metric_data):
+        (mtype, mhelp) = METRIC_DEFS[name]
+        lines.append("# HELP {0} {1}".format(name, mhelp))
+        lines.append("# TYPE {0} {1}".format(name, mtype))
+        for key, value in sorted(metric_data[name].items()):
+            if mtype == "histogram":
+                lines.extend(hist_lines(name, key, value))
+            else:
+                lines.append("{0}{1} {2}".format(name, label_str(key), value))
+    return "\n".join(lines) + "\n"
+
+
+def hist_lines(name, key, hist):
+    """Return exposition lines for one histogram."""
+    lines = ["{0}_bucket{1} {2}".format(name, label_str(key + (("le", x),)),
+                                        hist[i])
+             for i, x in enumerate(BUCKETS)]
+    lines.append("{0}_bucket{1} {2}".format(
+        name, label_str(key + (("le", "+Inf"),)), hist[-1]))
+    lines.append("{0}_sum{1} {2:.6f}".format(name, label_str(key), hist[-2]))
+    lines.append("{0}_count{1} {2}".format(name, label_str(key), hist[-1]))
+    return lines
+
+
+def label_str(key):
+    """Format label pairs as {name="value",...}."""
+    if not key:
+        return ""
+    pairs = [u'{0}="{1}"'.format(k, u"{0}".format(v).replace("\\", "\\\\").
+                                 replace('"', '\\"').replace("\n", "\\n"))
+             for k, v in key]
+    return "{" + ",".join(pairs) + "}"
+
+
+def metrics_write(path):
+    """Write metrics file for the node_exporter textfile collector.
+
+    The file is replaced atomically so partial files are never scraped.
+    """
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(metrics_text())
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Error writing metrics file {0}: {1}\n".
+                         format(path, e))
+
+
+def metrics_file_on_exit(path):
+    """Write metrics file when the program exits, including aborts."""
+    atexit.register(metrics_write, path)
+
+
+def metrics_app(environ, start_response):
+    """WSGI app serving metrics at /metrics."""
+    if environ.get("PATH_INFO") not in ("/", "/metrics"):
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Not Found\n"]
+    start_response("200 OK", [("Content-Type",
+                               "text/plain; version=0.0.4; charset=utf-8")])
+    return [metrics_text().encode("utf-8")]
+
+
+def metrics_serve(listen):
+    """Start HTTP metrics endpoint in the background.
+
+    listen is PORT or ADDR:PORT, the address defaults to localhost.
+    """
+    from gevent.pywsgi import WSGIServer
+    (addr, unused, port) = listen.rpartition(":")
+    try:
+        server = WSGIServer((addr or "127.0.0.1", int(port)), metrics_app,
+                            log=None)
+        server.start()
+    except (ValueError, IOError, OSError) as e:
+        print("Error starting metrics endpoint on {0}: {1}".format(listen, e))
+        sys.exit()
+    return server
@@ -0,0 +1,366 @@
+"""Shared cache of normalized node data across processes and users.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+import mcc.cldcnct as cld
+from libcloud.compute.base import Node
+from mcc.confdir import CONFIG_DIR
+import binascii
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # Windows, locking disabled
+
+CACHE_TTL = 300
+"""Default seconds cached nodes are used, override with cache_ttl."""
+
+LOCK_TIMEOUT = 120
+"""Maximum seconds to wait for another process refreshing an entry."""
+
+REC_FIELDS = ("id", "name", "state", "public_ips", "private_ips", "zone",
+              "size", "cloud", "cloud_disp", "tags", "group")
+"""Node attributes stored in the cache."""
+
+METRICS = ("hit", "miss", "refresh")
+
+SHARED_MODE = 0o664
+"""Mode of cache and lock files, group-writable so a group can share them."""
+
+
+def cache_open(info):
+    """Return cache backend configured in [info], or None if disabled."""
+    backend = info.get("cache_backend", "none")
+    if backend == "sqlite":
+        path = info.get("cache_path") or u"{0}nodecache.db".format(CONFIG_DIR)
+        try:
+            return SqliteCache(path)
+        except (sqlite3.Error, IOError, OSError) as e:
+            print("Error opening cache {0}: {1} - caching disabled".
+                  format(path, e))
+            return None
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            print("cache_backend 'redis' requires the redis package - "
+                  "caching disabled")
+            return None
+        return RedisCache(redis.StrictRedis.from_url(
+            info.get("cache_url") or "redis://localhost:6379/0"))
+    return None
+
+
+def cache_key(crid, cred):
+    """Calculate cache key for provider section.
+
+    Includes a hash of the credentials, so sections with the same name
+    but different accounts don't share entries.
+    """
+    digest = hashlib.sha256(json.dumps(cred, sort_keys=True).
+                            encode('utf-8')).hexdigest()[:16]
+    return "{0}:{1}".format(crid, digest)
+
+
+def section_ttl(info, section):
+    """Return cache TTL for provider section."""
+    return int(section.get("cache_ttl", info.get("cache_ttl", CACHE_TTL)))
+
+
+def cached_collect(store, cred, providers, info):
+    """Return nodes from cache, refreshing stale sections from providers.
+
+    Only one process refreshes a stale section, others wait for its
+    lock then use the refreshed entry.  Returns (node-lists, sections
+    refreshed by this process).
+    """
+    keys = {x: cache_key(x, cred[x]) for x in providers}
+    nodes = {}
+    stale = cached_get(store, cred, info, keys, providers, nodes)
+    store.incr("hit", len(providers) - len(stale))
+    store.incr("miss", len(stale))
+    refresh = []
+    if stale:
+        locked = [keys[x] for x in sorted(stale)]
+        store.lock(locked)
+        try:  # re-check, may be refreshed while waiting
+            refresh = cached_get(store, cred, info, keys, stale, nodes)
+            cached_refresh(store, cred, keys, refresh, nodes)
+        finally:
+            store.unlock(locked)
+    return [nodes[x] for x in providers], refresh
+
+
+def cached_get(store, cred, info, keys, crids, nodes):
+    """Add cached nodes of sections in crids to nodes, return those stale."""
+    stale = []
+    for crid in crids:
+        records = store.get(keys[crid], section_ttl(info, cred[crid]))
+        if records is None:
+            stale.append(crid)
+        else:
+            nodes[crid] = records_to_nodes(records)
+    return stale
+
+
+def cached_refresh(store, cred, keys, refresh, nodes):
+    """Collect sections in refresh from providers, store them and add to nodes."""
+    if not refresh:
+        return
+    (unused, new_nodes) = cld.get_conns_data(cred, refresh)
+    for crid, crid_nodes in zip(refresh, new_nodes):
+        store.put(keys[crid], nodes_to_records(crid_nodes))
+        nodes[crid] = crid_nodes
+    store.incr("refresh", len(refresh))
+
+
+def cached_read(store, cred, providers):
+    """Return nodes from cache whatever their age, never connecting.
+
+    Sections without a cache entry are reported and have no nodes.
+    """
+    nodes = []
+    for crid in providers:
+        records = store.get(cache_key(crid, cred[crid]), None)
+        if records is None:
+            print("No cached nodes for {0}".format(crid))
+        nodes.append(records_to_nodes(records or []))
+    return nodes
+
+
+def cache_store(store, cred, providers, node_list):
+    """Store nodes collected by other means, such as command mode."""
+    for crid, crid_nodes in zip(providers, node_list):
+        store.put(cache_key(crid, cred[crid]), nodes_to_records(crid_nodes))
+
+
+def shared_create(path):
+    """Create file at path with SHARED_MODE, unless it exists."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, SHARED_MODE)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return
+        raise
+    os.close(fd)
+    os.chmod(path, SHARED_MODE)  # mode given to open is reduced by umask
+
+
+def nodes_to_records(nodes):
+    """Convert nodes to list of dicts of cached fields."""
+    return [{x: getattr(node, x, None) for x in REC_FIELDS}
+            for node in nodes]
+
+
+def records_to_nodes(records):
+    """Convert cached records to nodes without a driver connection."""
+    nodes = []
+    for rec in records:
+        node = Node(rec["id"], rec["name"], rec["state"], None, None, None)
+        for field in REC_FIELDS:
+            setattr(node, field, rec.get(field))
+        node.tags = node.tags or {}
+        nodes.append(node)
+    return nodes
+
+
+def cache_stats(store):
+    """Print cache metrics."""
+    if not store:
+        print("Cache not enabled, set cache_backend in [info]")
+        return
+    stats = store.stats()
+    total = stats["hit"] + stats["miss"]
+    ratio = 100.0 * stats["hit"] / total if total else 0
+    print("Cache: {0} hits, {1} misses ({2:.0f}% hit rate), {3} refreshes".
+          format(stats["hit"], stats["miss"], ratio, stats["refresh"]))
+
+
+class SqliteCache(object):
+    """Cache in a SQLite file with fcntl locks for single-flight refresh.
+
+    Files another user created without write access for us are used
+    read-only, nodes are then collected and not stored.
+    """
+
+    def __init__(self, path):
+        """Open database and create tables, raising on failure."""
+        self.path = path
+        self.lock_files = []
+        self.writable = True
+        shared_create(path)
+        self.conn = sqlite3.connect(path, timeout=30)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS nodes (key TEXT"
+                              " PRIMARY KEY, ts REAL, data TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS metrics (name"
+                              " TEXT PRIMARY KEY, value INTEGER)")
+
+    def write_failed(self, err):
+        """Stop writing to cache after err, reporting it once."""
+        if self.writable:
+            print("Cache {0} not writable: {1} - nodes not cached".
+                  format(self.path, err))
+        self.writable = False
+
+    def get(self, key, ttl):
+        """Return records for key if younger than ttl seconds (or None)."""
+        oldest = 0 if ttl is None else time.time() - ttl
+        row = self.conn.execute("SELECT data FROM nodes WHERE key = ? AND"
+                                " ts > ?", (key, oldest)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, records):
+        """Store records for key."""
+        if not self.writable:
+            return
+        try:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO nodes VALUES"
+                                  " (?, ?, ?)", (key, time.time(),
+                                                 json.dumps(records)))
+        except sqlite3.Error as e:
+            self.write_failed(e)
+
+    def incr(self, name, amount=1):
+        """Increase metric counter."""
+        if not amount or not self.writable:
+            return
+        try:
+            with self.conn:
+                self.conn.execute("INSERT OR IGNORE INTO metrics VALUES"
+                                  " (?, 0)", (name,))
+                self.conn.execute("UPDATE metrics SET value = value + ? WHERE"
+                                  " name = ?", (amount, name))
+        except sqlite3.Error as e:
+            self.write_failed(e)
+
+    def stats(self):
+        """Return metric counters."""
+        stats = dict.fromkeys(METRICS, 0)
+        stats.update(self.conn.execute("SELECT name, value FROM metrics"))
+        return stats
+
+    def lock(self, keys):
+        """Acquire exclusive locks for keys, waiting for other holders."""
+        if fcntl is None or not self.writable:
+            return
+        for key in keys:
+            lock_name = u"{0}.{1}.lock".format(self.path, key.replace(":", "-"))
+            try:
+                shared_create(lock_name)
+                lock_file = open(lock_name, "a")
+            except (IOError, OSError) as e:
+                self.write_failed(e)  # refresh without lock, as on timeout
+                return
+            deadline = time.time() + LOCK_TIMEOUT
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except (IOError, OSError):
+                    if time.time() > deadline:
+                        break  # holder appears stuck, refresh anyway
+                    time.sleep(0.2)
+            self.lock_files.append(lock_file)
+
+    def unlock(self, keys):
+        """Release locks held."""
+        for lock_file in self.lock_files:
+            lock_file.close()
+        self.lock_files = []
+
+
+class RedisCache(object):
+    """Cache in Redis (or a compatible server) using SET NX locks."""
+
+    PREFIX = "mcc:"
+
+    UNLOCK_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then"
+                     " return redis.call('del', KEYS[1]) end return 0")
+    """Delete a lock only if it still holds our token, as it may have
+    expired and been taken by another process."""
+
+    def __init__(self, client):
+        """Use redis client for storage."""
+        self.client = client
+        self.tokens = {}
+
+    def get(self, key, ttl):
+        """Return records for key if younger than ttl seconds (or None)."""
+        value = self.client.get(self.PREFIX + "nodes:" + key)
+        if value is None:
+            return None
+        entry = json.loads(value.decode('utf-8'))
+        oldest = 0 if ttl is None else time.time() - ttl
+        return entry["data"] if entry["ts"] > oldest else None
+
+    def put(self, key, records):
+        """Store records for key, expiring unused entries after a day."""
+        self.client.set(self.PREFIX + "nodes:" + key,
+                        json.dumps({"ts": time.time(), "data": records}),
+                        ex=86400)
+
+    def incr(self, name, amount=1):
+        """Increase metric counter."""
+        if amount:
+            self.client.incrby(self.PREFIX + "metrics:" + name, amount)
+
+    def stats(self):
+        """Return metric counters."""
+        values = self.client.mget([self.PREFIX + "metrics:" + x
+                                   for x in METRICS])
+        return {x: int(v or 0) for x, v in zip(METRICS, values)}
+
+    def lock(self, keys):
+        """Acquire locks for keys, waiting for other holders.
+
+        Each lock holds a unique token, locks not acquired before the
+        wait times out are not held and not released.
+        """
+        for key in keys:
+            token = binascii.hexlify(os.urandom(16)).decode('ascii')
+            deadline = time.time() + LOCK_TIMEOUT
+            while not self.client.set(self.PREFIX + "lock:" + key, token,
+                                      nx=True, ex=LOCK_TIMEOUT):
+                if time.time() > deadline:
+                    token = None  # holder appears stuck, refresh anyway
+                    break
+                time.sleep(0.2)
+            if token:
+                self.tokens[key] = token
+
+    def unlock(self, keys):
+        """Release locks held, leaving locks held by other processes."""
+        for key in keys:
+            token = self.tokens.pop(key, None)
+            if token:
+                self.client.eval(self.UNLOCK_SCRIPT, 1,
+                                 self.PREFIX + "lock:" + key, token)
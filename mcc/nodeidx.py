@@ -0,0 +1,214 @@
+"""Index node attributes and tags for queries and group summaries.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from bisect import bisect_right
+from fnmatch import fnmatch
+import re
+
+INDEX_FIELDS = ("cloud", "zone", "size", "state", "group", "name")
+"""Node attributes indexed, other query keys are treated as tags."""
+
+
+def index_build(node_dict):
+    """Create index of {field: {value: set(node-numbers)}}.
+
+    Tags are indexed under the field "tag:<key>".
+    """
+    index = {field: {} for field in INDEX_FIELDS}
+    for num, node in node_dict.items():
+        for field in INDEX_FIELDS:
+            value = str(getattr(node, field, None) or "")
+            index[field].setdefault(value.lower(), set()).add(num)
+        for key, value in getattr(node, "tags", {}).items():
+            index.setdefault("tag:" + key.lower(),
+                             {}).setdefault(value.lower(), set()).add(num)
+    index["all"] = set(node_dict.keys())
+    return index
+
+
+def index_field(key):
+    """Return index field name for a query key."""
+    key = key.lower()
+    if key.startswith("tag."):
+        return "tag:" + key[len("tag."):]
+    return key if key in INDEX_FIELDS else "tag:" + key
+
+
+def index_match(index, term):
+    """Return node numbers matching one query term.
+
+    Terms have the form key=value, key!=value or key (key exists).
+    Values may contain wildcards.
+    """
+    (key, oper, value) = term_split(term)
+    values = index.get(index_field(key), {})
+    if not oper:
+        return set().union(*[v for k, v in values.items() if k])
+    matched = values_match(values, value.lower())
+    if oper == "!=":
+        return index["all"] - matched
+    return matched
+
+
+def values_match(values, value):
+    """Return node numbers of index values matching value or pattern."""
+    if any(x in value for x in "*?["):
+        return set().union(*[v for k, v in values.items()
+                             if fnmatch(k, value)])
+    return values.get(value, set())
+
+
+def term_split(term):
+    """Split query term into key, operator and value."""
+    for oper in ("!=", "="):
+        if oper in term:
+            (key, unused, value) = term.partition(oper)
+            return key, oper, value
+    return term, "", ""
+
+
+def index_query(index, query):
+    """Return sorted node numbers matching all terms in query.
+
+    Sets are intersected smallest first, so the cost of a query follows
+    the size of its most selective term rather than the node count.
+    """
+    matches = sorted((index_match(index, x) for x in query.split()), key=len)
+    if not matches:
+        return sorted(index["all"])
+    result = matches[0]
+    for matched in matches[1:]:
+        result = result & matched
+    return sorted(result)
+
+
+def index_group(index, node_dict, nums, group_by):
+    """Summarize nodes by value of field, giving count & sizes per group."""
+    field = index_field(group_by)
+    num_set = set(nums)
+    groups = OrderedDict()
+    for value, members in sorted(index.get(field, {}).items()):
+        members = members & num_set
+        if members:
+            groups[value or "-"] = members
+    untagged = num_set - set().union(*groups.values())
+    if untagged:
+        groups["-"] = groups.get("-", set()) | untagged
+    summary = OrderedDict()
+    for value, members in groups.items():
+        sizes = {}
+        for num in members:
+            size = node_dict[num].size or "-"
+            sizes[size] = sizes.get(size, 0) + 1
+        summary[value] = [len(members), sizes]
+    return summary
+
+
+def dict_filter(node_dict, nums):
+    """Create renumbered node dict containing only nodes listed in nums."""
+    return {x: node_dict[num] for x, num in enumerate(nums, 1)}
+
+
+def search_build(node_dict):
+    """Create search index of node names, IPs, ids and tags.
+
+    Holds the normalized search text of each node, built once per
+    refresh, and the last query & result so longer queries only check
+    the nodes the shorter one matched.  Names are also joined into one
+    string, so fuzzy matches are found in a single regex scan.
+    """
+    nums = list(node_dict.keys())
+    names = [(node_dict[x].name or "").lower().replace("\n", " ")
+             for x in nums]
+    offsets = []
+    pos = 0
+    for name in names:
+        offsets.append(pos)
+        pos += len(name) + 1
+    return {"nums": nums,
+            "text": [search_text(node_dict[x]) for x in nums],
+            "names": names, "name_str": "\n".join(names),
+            "name_pos": offsets, "last": ("", [])}
+
+
+def search_text(node):
+    """Return lowercase text of node fields matched by search."""
+    fields = [node.name, node.public_ips, node.private_ips, node.id]
+    fields.extend(u"{0}={1}".format(k, v) for k, v in
+                  sorted(getattr(node, "tags", {}).items()))
+    return u"\n".join(u"{0}".format(x) for x in fields if x).lower()
+
+
+def search_query(search_idx, query):
+    """Return node numbers matching all words of query, best first.
+
+    Words match anywhere in a node's name, IPs, id or tags.  Nodes whose
+    name starts with the first word are listed first.  If nothing
+    matches, nodes whose name contains the query's characters in order
+    are returned (fuzzy match).
+    """
+    words = query.lower().split()
+    if not words:
+        return []
+    found = search_words(search_idx, query, words)
+    if found:
+        found = search_order(search_idx, found, words[0])
+    else:
+        found = search_fuzzy(search_idx, "".join(words))
+    return [search_idx["nums"][i] for i in found]
+
+
+def search_words(search_idx, query, words):
+    """Return positions of nodes matching all words and remember them."""
+    (last_query, found) = search_idx["last"]
+    texts = search_idx["text"]
+    # typing narrows previous matches, otherwise check every node
+    if not (last_query and query.startswith(last_query) and found):
+        found = range(len(texts))
+    for word in words:
+        found = [i for i in found if word in texts[i]]
+    search_idx["last"] = (query, found)
+    return found
+
+
+def search_order(search_idx, found, word):
+    """Return positions with names starting with word moved first."""
+    names = search_idx["names"]
+    first = [i for i in found if names[i].startswith(word)]
+    first_set = set(first)
+    return first + [i for i in found if i not in first_set]
+
+
+def search_fuzzy(search_idx, chars):
+    """Return positions of names containing chars in order."""
+    pattern = re.compile("[^\n]*?".join(re.escape(x) for x in chars))
+    offsets = search_idx["name_pos"]
+    found = []
+    for match in pattern.finditer(search_idx["name_str"]):
+        pos = bisect_right(offsets, match.start()) - 1
+        if not found or found[-1] != pos:
+            found.append(pos)
+    return found
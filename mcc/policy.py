@@ -0,0 +1,255 @@
+"""Plan and apply scheduled power policies (off-hours stop / start).
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+import configparser
+from collections import OrderedDict
+from gevent.pool import Group
+from mcc.confdir import CONFIG_DIR
+from mcc.confread import config_errors
+from mcc.metrics import counter_inc
+from mcc.providers import node_action
+from mcc.waitstate import wait_add, wait_poll
+import mcc.history as history
+import mcc.nodecache as nodecache
+import mcc.nodeidx as nodeidx
+import os
+import re
+import sys
+
+POLICY_FILE = u"{0}policies.ini".format(CONFIG_DIR)
+"""Optional file of policies, one per section.
+
+Policies may also be sections named 'policy:NAME' in config files.
+Each has a select query (as used by --query) and a start and stop time
+(HH:MM, local time) between which selected nodes run on the listed
+days.  Outside that window they are stopped.
+"""
+
+POLICY_KEYS = ["select", "start", "stop", "days", "actions"]
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+ACTION_CHOICES = {"both": ("run", "stop"), "start": ("run",),
+                  "stop": ("stop",)}
+"""Commands each 'actions' entry permits, 'stop' never starts nodes."""
+
+CMD_FROM = {"run": "stopped", "stop": "running"}
+"""State a node must be in for a command to be planned."""
+
+BATCH_SIZE = 10
+"""Nodes sent a command at once per provider connection."""
+
+
+def policies_read(config_files):
+    """Read policies from config files then the policy file.
+
+    Later policies with the same name replace earlier ones.  Nodes
+    selected by more than one policy follow the first.
+    """
+    files = list(config_files)
+    if os.path.isfile(POLICY_FILE):
+        files.append(POLICY_FILE)
+    policies = OrderedDict()
+    errors = []
+    for path in files:
+        for (section, entries) in policy_sections(path):
+            name = re.sub(r"^policy:", "", section)
+            (policy, policy_errors) = policy_parse(name, entries)
+            errors.extend("[{0}] {1}".format(section, x) for x in policy_errors)
+            policies[name] = policy
+    if errors:
+        config_errors([], errors)
+    return list(policies.values())
+
+
+def policy_sections(path):
+    """Return [(section-name, entries)] of policies in file at path."""
+    config = configparser.ConfigParser(allow_no_value=True, interpolation=None)
+    try:
+        config.read(path, encoding='utf-8')
+    except (IOError, configparser.Error) as e:
+        print("Error reading policies from {0}: {1}".format(path, e))
+        sys.exit()
+    return [(x, dict(config[x].items())) for x in config.sections()
+            if path == POLICY_FILE or x.startswith("policy:")]
+
+
+def policy_parse(name, section):
+    """Return (policy, errors) for a policy section."""
+    errors = ["unknown entry '{0}'".format(x) for x in section
+              if x not in POLICY_KEYS]
+    policy = {"name": name, "select": (section.get("select") or "").strip()}
+    if not policy["select"]:
+        errors.append("missing entry 'select'")
+    fields = [("start", clock_parse, "", "start must be a time as HH:MM"),
+              ("stop", clock_parse, "", "stop must be a time as HH:MM"),
+              ("days", days_parse, "mon-sun",
+               "days must be day names or ranges, e.g. mon-fri,sun"),
+              ("actions", actions_parse, "both",
+               "actions must be one of: {0}".format(
+                   ", ".join(sorted(ACTION_CHOICES))))]
+    for (key, parse, default, error) in fields:
+        try:
+            policy[key] = parse(section.get(key) or default)
+        except ValueError:
+            errors.append(error)
+    return policy, errors
+
+
+def clock_parse(text):
+    """Convert HH:MM to minutes after midnight."""
+    match = re.match(r"^(\d{1,2}):(\d{2})$", text.strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError(text)
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def days_parse(text):
+    """Convert comma separated day names or ranges to set of weekdays."""
+    days = set()
+    for part in text.lower().split(","):
+        (first, unused, last) = (x.strip()[:3] for x in part.partition("-"))
+        first = DAY_NAMES.index(first)  # ValueError if not a day name
+        last = DAY_NAMES.index(last) if last else first
+        days.update(x % 7 for x in range(first, last + 1 + 7 * (last < first)))
+    return days
+
+
+def actions_parse(text):
+    """Convert actions entry to commands it permits."""
+    if text not in ACTION_CHOICES:
+        raise ValueError(text)
+    return ACTION_CHOICES[text]
+
+
+def policy_state(policy, now):
+    """Return state policy requires at datetime now.
+
+    A window ending before it starts (start 22:00, stop 06:00) runs
+    overnight and belongs to the day it starts.
+    """
+    minute = now.hour * 60 + now.minute
+    (start, stop) = (policy["start"], policy["stop"])
+    day = now.weekday()
+    if start <= stop:
+        inside = start <= minute < stop
+    else:
+        inside = minute >= start or minute < stop
+        if minute < stop:
+            day = (day - 1) % 7
+    return "running" if inside and day in policy["days"] else "stopped"
+
+
+def plan_make(policies, node_dict, now, query=""):
+    """Return [(policy-name, node, command)] bringing nodes to policy state.
+
+    Only nodes running or stopped are planned, nodes in transition are
+    left for the next run.  query limits the nodes policies apply to.
+    """
+    index = nodeidx.index_build(node_dict)
+    allowed = set(nodeidx.index_query(index, query))
+    claimed = set()
+    plan = []
+    for policy in policies:
+        cmd_name = "run" if policy_state(policy, now) == "running" else "stop"
+        for num in nodeidx.index_query(index, policy["select"]):
+            if num in claimed or num not in allowed:
+                continue
+            claimed.add(num)
+            node = node_dict[num]
+            if cmd_name in policy["actions"] and node.state == CMD_FROM[cmd_name]:
+                plan.append((policy["name"], node, cmd_name))
+    return plan
+
+
+def plan_run(plan, batch_size=BATCH_SIZE):
+    """Execute plan, returning {node-id: result}.
+
+    Commands are sent in batches per provider connection, connections
+    are processed concurrently.  Nodes sent commands are then waited
+    for together.
+    """
+    streams = OrderedDict()
+    for (unused, node, cmd_name) in plan:
+        streams.setdefault((node.driver, cmd_name), []).append(node)
+    (pending, sched) = ({}, {})
+    results = plan_send(streams, batch_size, pending, sched)
+    while pending:
+        results.update((k, "timeout" if v == "timeout" else "done")
+                       for k, v in wait_poll(pending, sched).items())
+    for (unused, node, cmd_name) in plan:
+        result = results[node.id].split(":")[0]
+        counter_inc("mcc_actions_total", cloud=node.cloud, action=cmd_name,
+                    result="ok" if result == "done" else result)
+    return results
+
+
+def plan_send(streams, batch_size, pending, sched):
+    """Send each stream's commands, adding sent nodes to pending.
+
+    Returns {node-id: result} for nodes that failed.
+    """
+    sent = Group().map(lambda x: batch_send(x[0][1], x[1], batch_size),
+                       streams.items())
+    results = {}
+    for ((unused, cmd_name), nodes), errors in zip(streams.items(), sent):
+        results.update((k, "failed: " + v) for k, v in errors.items() if v)
+        wait_add(pending, sched, [x for x in nodes if not errors[x.id]],
+                 cmd_name)
+    return results
+
+
+def batch_send(cmd_name, nodes, batch_size):
+    """Send command to nodes a batch at a time, returning {node-id: error}."""
+    errors = {}
+    for start in range(0, len(nodes), batch_size):
+        batch = nodes[start:start + batch_size]
+        errors.update(zip([x.id for x in batch],
+                          Group().map(lambda x: action_send(x, cmd_name),
+                                      batch)))
+    return errors
+
+
+def action_send(node, cmd_name):
+    """Send command to node, returning error text if it fails."""
+    try:
+        node_action(node, cmd_name)
+    except Exception as e:
+        return u"{0}".format(e) or e.__class__.__name__
+    return None
+
+
+def cached_nodes(cred, providers, info):
+    """Return node lists from the shared cache or the history database.
+
+    The cache is read whatever its age, without connecting to providers.
+    Nodes from history have no tags, so tag selectors don't match them.
+    """
+    store = nodecache.cache_open(info)
+    if store:
+        return nodecache.cached_read(store, cred, providers)
+    print("Shared cache not enabled, using nodes recorded by the last"
+          " collection (tag selectors won't match)")
+    return [nodecache.records_to_nodes(history.history_current())]
@@ -0,0 +1,150 @@
+"""Registry of cloud provider modules, loaded when first used.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from importlib import import_module
+
+PROVIDER_MODULES = {"aws": "mcc.providers.aws",
+                    "azure": "mcc.providers.azure",
+                    "gcp": "mcc.providers.gcp",
+                    "alicloud": "mcc.providers.alicloud",
+                    "sim": "mcc.providers.sim"}
+"""Built-in providers: {provider-name: module}.
+
+Additional providers are registered by other packages as entry points in
+the "mcc.providers" group, with the provider name as the entry point
+name and the provider module as its target.
+
+A provider module defines:
+    CLOUD_DISP: display name
+    ACTIONS: {command: driver-method-name} for node commands
+    POLL: [initial, backoff-multiplier, maximum] state poll interval
+    cred_keys(cred): return ([required-entries], [optional-entries]),
+        raising ValueError for invalid entry values
+    connect(cred, crid): return {crid: connection-object}
+    list_nodes(c_obj): return list of normalized nodes
+    normalize(nodes): set common node attributes (cloud, zone, size, ..)
+    list_args(node_ids): list_nodes kwargs to limit listing to node_ids
+    region(node): return region of node
+    ssh_prepare(nodes): return context data used by ssh_profile
+    ssh_profile(node, context): return {"user": .., "key": ..}
+    details(node): return OrderedDict of {section-title: [(label, value)]},
+        sections needing API calls are functions returning the rows
+"""
+
+ENTRY_POINT_GROUP = "mcc.providers"
+
+NORM_WORKERS = 2
+"""Default threads normalizing large listings, 0 normalizes inline."""
+
+NORM_CHUNK = 2000
+"""Default nodes per normalization task, smaller listings run inline."""
+
+prov_loaded = {}
+
+norm_opts = {"workers": NORM_WORKERS, "chunk": NORM_CHUNK, "pool": None}
+
+
+def prov_key(crid, cred=None):
+    """Return provider name for a config section.
+
+    Uses the section's 'provider' entry if present, otherwise the section
+    name without numeric suffix (aws2 = aws).
+    """
+    return (cred or {}).get("provider") or crid.rstrip('1234567890')
+
+
+def prov_get(name):
+    """Return provider module, importing it on first use."""
+    if name not in prov_loaded:
+        if name in PROVIDER_MODULES:
+            prov_loaded[name] = import_module(PROVIDER_MODULES[name])
+        else:
+            prov_loaded[name] = prov_entry_point(name).load()
+    return prov_loaded[name]
+
+
+def prov_entry_point(name):
+    """Return entry point registered for provider name or None."""
+    try:
+        from pkg_resources import iter_entry_points
+    except ImportError:  # pragma: no cover
+        return None
+    return next(iter_entry_points(ENTRY_POINT_GROUP, name), None)
+
+
+def prov_supported(name):
+    """Determine if a provider module is available for name."""
+    return name in PROVIDER_MODULES or prov_entry_point(name) is not None
+
+
+def node_prov(node):
+    """Return provider module for node."""
+    return prov_get(node.cloud)
+
+
+def node_action(node, cmd_name):
+    """Execute command on node using the provider's driver method."""
+    method = getattr(node.driver, node_prov(node).ACTIONS[cmd_name])
+    return method(node)
+
+
+def norm_setup(info):
+    """Set normalization options from the [info] section."""
+    norm_opts["workers"] = int(info.get("normalize_workers", NORM_WORKERS))
+    norm_opts["chunk"] = max(int(info.get("normalize_chunk", NORM_CHUNK)), 1)
+
+
+def norm_run(normalize, nodes):
+    """Normalize nodes, in chunks on worker threads for large listings.
+
+    Workers are OS threads outside the gevent loop, so the busy display
+    and other providers' requests continue while they run.
+    """
+    (workers, chunk) = (norm_opts["workers"], norm_opts["chunk"])
+    if not workers or len(nodes) <= chunk:
+        return normalize(nodes)
+    if norm_opts["pool"] is None:
+        from gevent.threadpool import ThreadPool
+        norm_opts["pool"] = ThreadPool(workers)
+    chunks = [nodes[x:x + chunk] for x in range(0, len(nodes), chunk)]
+    return [node for part in norm_opts["pool"].map(normalize, chunks)
+            for node in part]
+
+
+def ip_to_str(raw_ip):
+    """Convert IP Address list to string or null."""
+    if raw_ip:
+        return raw_ip[0]
+    else:
+        return None
+
+
+def tags_to_dict(raw_tags):
+    """Convert provider tags or labels to dict of strings."""
+    if isinstance(raw_tags, list):  # [{Key: k, Value: v}] style tags
+        raw_tags = dict((x.get('Key', x.get('TagKey')),
+                         x.get('Value', x.get('TagValue'))) for x in raw_tags)
+    return {k: (v if v is not None else "")
+            for k, v in (raw_tags or {}).items() if k}
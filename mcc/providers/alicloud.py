@@ -0,0 +1,146 @@
+"""Alibaba Cloud ECS provider.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from mcc.cldcnct import abort_err  # imported first to apply monkey-patching
+from libcloud.compute.types import Provider
+from libcloud.compute.providers import get_driver
+from libcloud.common.types import InvalidCredsError
+from libcloud.common.exceptions import BaseHTTPError
+from requests.exceptions import SSLError
+from collections import OrderedDict
+from functools import partial
+from mcc.providers import ip_to_str, tags_to_dict, norm_run
+import re
+
+CLOUD_DISP = "AliCloud"
+ACTIONS = {"run": "ex_start_node", "stop": "ex_stop_node"}
+POLL = [2.0, 1.5, 15.0]
+
+CRED_REQUIRED = ["ali_region", "ali_access_key_id", "ali_access_key_secret"]
+
+
+def cred_keys(cred):
+    """Return required and optional config entries."""
+    return CRED_REQUIRED, []
+
+
+def connect(cred, crid):
+    """Establish connection to AliCloud service."""
+    driver = get_driver(Provider.ALIYUN_ECS)
+    try:
+        ali_obj = driver(cred['ali_access_key_id'],
+                         cred['ali_access_key_secret'],
+                         region=cred['ali_region'])
+    except SSLError as e:
+        abort_err("\r SSL Error with AliCloud: {}".format(e))
+    except InvalidCredsError as e:
+        abort_err("\r Error with AliCloud Credentials: {}".format(e))
+    return {crid: ali_obj}
+
+
+def list_nodes(c_obj):
+    """Get node objects from AliCloud."""
+    ali_nodes = []
+    try:
+        ali_nodes = c_obj.list_nodes()
+    except BaseHTTPError as e:
+        abort_err("\r HTTP Error with AliCloud: {}".format(e))
+    ali_nodes = norm_run(normalize, ali_nodes)
+    return ali_nodes
+
+
+def normalize(ali_nodes):
+    """Adjust details specific to AliCloud."""
+    for node in ali_nodes:
+        node.cloud = "alicloud"
+        node.cloud_disp = CLOUD_DISP
+        node.private_ips = ip_to_str(node.extra['vpc_attributes']['private_ip_address'])
+        node.public_ips = ip_to_str(node.public_ips)
+        node.zone = node.extra['zone_id']
+        node.size = node.extra['instance_type']
+        if node.size.startswith('ecs.'):
+            node.size = node.size[len('ecs.'):]
+        node.tags = tags_to_dict(node.extra.get('tags'))
+        node.group = None
+    return ali_nodes
+
+
+def list_args(node_ids):
+    """Limit node listing to node_ids."""
+    return {"ex_node_ids": node_ids}
+
+
+def region(node):
+    """Calculate region from zone."""
+    return re.sub(r"-?[a-z]$", "", node.zone or "")
+
+
+SSH_PROFILE_CACHE = False
+
+
+def ssh_prepare(nodes):
+    """No preparation required."""
+    return None
+
+
+def ssh_profile(node, context):
+    """No provider data identifies the ssh user, use ssh defaults."""
+    return {"key": "", "user": ""}
+
+
+def details(node):
+    """Return detail sections, fetching image and disks when called."""
+    extra = node.extra or {}
+    vpc = extra.get('vpc_attributes') or {}
+    eip = extra.get('eip_address') or {}
+    return OrderedDict([
+        ("Instance", [("id", node.id), ("created", extra.get("creation_time")),
+                      ("hostname", extra.get("hostname")),
+                      ("charge type", extra.get("instance_charge_type")),
+                      ("expires", extra.get("expired_time"))]),
+        ("Image", partial(details_image, node)),
+        ("Volumes", partial(details_volumes, node)),
+        ("Network Interfaces", [("vpc", vpc.get("vpc_id")),
+                                ("vswitch", vpc.get("vswitch_id")),
+                                ("private ip", node.private_ips),
+                                ("elastic ip", eip.get("ip_address"))]),
+        ("Security Groups", [(x, "") for x in
+                             extra.get("security_group_ids") or []]),
+        ("Tags", sorted(node.tags.items()))])
+
+
+def details_image(node):
+    """Get name & description of node's image."""
+    image = node.driver.get_image(node.extra['image_id'])
+    return [(image.id, image.name),
+            ("description", image.extra.get("description"))]
+
+
+def details_volumes(node):
+    """Get disks attached to node."""
+    vols = node.driver.list_volumes(ex_filters={"InstanceId": node.id})
+    return [(vol.extra.get("device") or vol.id, "{0} {1} GB {2}".format(
+        vol.id, vol.size, vol.extra.get("category")))
+        for vol in vols]
@@ -0,0 +1,173 @@
+"""AWS EC2 provider.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from mcc.cldcnct import abort_err  # imported first to apply monkey-patching
+from libcloud.compute.types import Provider
+from libcloud.compute.providers import get_driver
+from libcloud.common.types import InvalidCredsError
+from libcloud.common.exceptions import BaseHTTPError
+from requests.exceptions import SSLError
+from collections import OrderedDict
+from functools import partial
+from mcc.providers import ip_to_str, tags_to_dict, norm_run
+from mcc.confdir import CONFIG_DIR
+import re
+
+CLOUD_DISP = "AWS"
+ACTIONS = {"run": "ex_start_node", "stop": "ex_stop_node"}
+POLL = [1.0, 1.5, 10.0]
+
+CRED_REQUIRED = ["aws_access_key_id", "aws_secret_access_key", "aws_default_region"]
+
+
+def cred_keys(cred):
+    """Return required and optional config entries."""
+    return CRED_REQUIRED, []
+
+
+def connect(cred, crid):
+    """Establish connection to AWS service."""
+    driver = get_driver(Provider.EC2)
+    try:
+        aws_obj = driver(cred['aws_access_key_id'],
+                         cred['aws_secret_access_key'],
+                         region=cred['aws_default_region'])
+    except SSLError as e:
+        abort_err("\r SSL Error with AWS: {}".format(e))
+    except InvalidCredsError as e:
+        abort_err("\r Error with AWS Credentials: {}".format(e))
+    return {crid: aws_obj}
+
+
+def list_nodes(c_obj):
+    """Get node objects from AWS."""
+    aws_nodes = []
+    try:
+        aws_nodes = c_obj.list_nodes()
+    except BaseHTTPError as e:
+        abort_err("\r HTTP Error with AWS: {}".format(e))
+    aws_nodes = norm_run(normalize, aws_nodes)
+    return aws_nodes
+
+
+def normalize(aws_nodes):
+    """Adjust details specific to AWS."""
+    for node in aws_nodes:
+        node.cloud = "aws"
+        node.cloud_disp = CLOUD_DISP
+        node.private_ips = ip_to_str(node.private_ips)
+        node.public_ips = ip_to_str(node.public_ips)
+        node.zone = node.extra['availability']
+        node.size = node.extra['instance_type']
+        node.type = node.extra['instance_lifecycle']
+        node.tags = tags_to_dict(node.extra.get('tags'))
+        node.group = None
+    return aws_nodes
+
+
+def list_args(node_ids):
+    """Limit node listing to node_ids."""
+    return {"ex_node_ids": node_ids}
+
+
+def region(node):
+    """Calculate region from availability zone."""
+    return re.sub(r"[a-z]$", "", node.zone or "")
+
+
+SSH_PROFILE_CACHE = True
+"""Persisted profiles are re-used as calculating them requires API calls."""
+
+
+def ssh_prepare(nodes):
+    """Get image names for nodes with one request per connection."""
+    by_driver = {}
+    for node in nodes:
+        by_driver.setdefault(node.driver, set()).add(node.extra['image_id'])
+    image_names = {}
+    for driver, image_ids in by_driver.items():
+        try:
+            images = driver.list_images(ex_image_ids=list(image_ids))
+        except BaseHTTPError:
+            images = []
+        image_names.update((image.id, image.name) for image in images)
+    return image_names
+
+
+def ssh_profile(node, image_names):
+    """Calculate ssh key and user from key-pair name and image name."""
+    image_name = image_names.get(node.extra['image_id'])
+    return {"key": "{0}{1}.pem".format(CONFIG_DIR, node.extra['key_name']),
+            "user": ssh_calc_user(node, image_name),
+            "image_name": image_name}
+
+
+def ssh_calc_user(node, image_name):
+    """Calculate default ssh-user based on image-name of AWS instance."""
+    userlu = {"ubunt": "ubuntu", "debia": "admin", "fedor": "root",
+              "cento": "centos", "openb": "root"}
+    if not image_name:
+        image_name = node.name
+    usertemp = ['name'] + [value for key, value in list(userlu.items())
+                           if key in image_name.lower()]
+    usertemp = dict(zip(usertemp[::2], usertemp[1::2]))
+    username = usertemp.get('name', 'ec2-user')
+    return username
+
+
+def details(node):
+    """Return detail sections, fetching image and volumes when called."""
+    extra = node.extra or {}
+    nics = [(x.id, "{0} {1} subnet {2}".format(
+        ", ".join(ip["private_ip"] for ip in x.extra.get("private_ips", [])),
+        x.extra.get("mac_address"), x.extra.get("subnet_id")))
+        for x in extra.get("network_interfaces", [])]
+    return OrderedDict([
+        ("Instance", [("id", node.id), ("launched", extra.get("launch_time")),
+                      ("key pair", extra.get("key_name")),
+                      ("iam profile", extra.get("iam_profile")),
+                      ("platform", extra.get("platform") or "linux"),
+                      ("vpc", extra.get("vpc_id")),
+                      ("subnet", extra.get("subnet_id"))]),
+        ("Image", partial(details_image, node)),
+        ("Volumes", partial(details_volumes, node)),
+        ("Network Interfaces", nics),
+        ("Security Groups", [(x["group_id"], x["group_name"])
+                             for x in extra.get("groups", [])]),
+        ("Tags", sorted(node.tags.items()))])
+
+
+def details_image(node):
+    """Get name & description of node's image."""
+    image = node.driver.get_image(node.extra['image_id'])
+    return [(image.id, image.name),
+            ("description", image.extra.get("description"))]
+
+
+def details_volumes(node):
+    """Get volumes attached to node."""
+    return [(vol.extra.get("device") or vol.id, "{0} {1} GB {2}".format(
+        vol.id, vol.size, vol.extra.get("volume_type")))
+        for vol in node.driver.list_volumes(node=node)]
@@ -0,0 +1,156 @@
+"""Azure Resource Manager provider.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from mcc.cldcnct import abort_err  # imported first to apply monkey-patching
+from libcloud.compute.types import Provider
+from libcloud.compute.providers import get_driver
+from libcloud.common.types import InvalidCredsError
+from libcloud.common.exceptions import BaseHTTPError
+from requests.exceptions import SSLError
+from collections import OrderedDict
+from functools import partial
+from gevent.pool import Group
+from mcc.providers import ip_to_str, tags_to_dict, norm_run
+
+CLOUD_DISP = "Azure"
+ACTIONS = {"run": "ex_start_node", "stop": "ex_stop_node"}
+POLL = [3.0, 1.5, 20.0]
+
+CRED_REQUIRED = ["az_tenant_id", "az_sub_id", "az_app_id", "az_app_sec"]
+
+
+def cred_keys(cred):
+    """Return required and optional config entries."""
+    return CRED_REQUIRED, []
+
+
+def connect(cred, crid):
+    """Establish connection to Azure service."""
+    driver = get_driver(Provider.AZURE_ARM)
+    try:
+        az_obj = driver(tenant_id=cred['az_tenant_id'],
+                        subscription_id=cred['az_sub_id'],
+                        key=cred['az_app_id'],
+                        secret=cred['az_app_sec'])
+    except SSLError as e:
+        abort_err("\r SSL Error with Azure: {}".format(e))
+    except InvalidCredsError as e:
+        abort_err("\r Error with Azure Credentials: {}".format(e))
+    return {crid: az_obj}
+
+
+def list_nodes(c_obj):
+    """Get node objects from Azure."""
+    az_nodes = []
+    try:
+        az_nodes = c_obj.list_nodes()
+    except BaseHTTPError as e:
+        abort_err("\r HTTP Error with Azure: {}".format(e))
+    az_nodes = norm_run(normalize, az_nodes)
+    return az_nodes
+
+
+def normalize(az_nodes):
+    """Adjust details specific to Azure."""
+    for node in az_nodes:
+        node.cloud = "azure"
+        node.cloud_disp = CLOUD_DISP
+        node.private_ips = ip_to_str(node.private_ips)
+        node.public_ips = ip_to_str(node.public_ips)
+        node.zone = node.extra['location']
+        node.size = node.extra['properties']['hardwareProfile']['vmSize']
+        node.tags = tags_to_dict(node.extra.get('tags'))
+        group_raw = node.id
+        unnsc, group_end = group_raw.split("resourceGroups/", 1)
+        group, unnsc = group_end.split("/", 1)
+        node.group = group
+    return az_nodes
+
+
+def list_args(node_ids):
+    """Listing can't be limited to specific nodes."""
+    return {}
+
+
+def region(node):
+    """Azure locations are regions."""
+    return node.zone
+
+
+SSH_PROFILE_CACHE = False
+
+
+def ssh_prepare(nodes):
+    """No preparation required, profile uses node data only."""
+    return None
+
+
+def ssh_profile(node, context):
+    """Get ssh user from VM OS profile."""
+    os_prof = node.extra['properties'].get('osProfile', {})
+    return {"key": "", "user": os_prof.get('adminUsername', "")}
+
+
+def details(node):
+    """Return detail sections, fetching disks and NICs when called."""
+    props = (node.extra or {}).get('properties', {})
+    storage = props.get('storageProfile', {})
+    image = storage.get('imageReference', {})
+    image_name = " / ".join(image[x] for x in ("publisher", "offer", "sku",
+                                               "version") if image.get(x))
+    return OrderedDict([
+        ("Instance", [("vm id", props.get("vmId")),
+                      ("created", props.get("timeCreated")),
+                      ("resource group", node.group),
+                      ("os", storage.get("osDisk", {}).get("osType"))]),
+        ("Image", [("image", image_name or image.get("id"))]),
+        ("Volumes", partial(details_volumes, node, storage)),
+        ("Network Interfaces", partial(details_nics, node, props)),
+        ("Tags", sorted(node.tags.items()))])
+
+
+def details_volumes(node, storage):
+    """Get managed disks of node concurrently."""
+    disks = [storage.get('osDisk', {})] + storage.get('dataDisks', [])
+    disk_ids = [x['managedDisk']['id'] for x in disks if x.get('managedDisk')]
+    vols = Group().map(node.driver.ex_get_volume, disk_ids)
+    return [(vol.name, "{0} GB {1}".format(
+        vol.size, vol.extra.get("sku", {}).get("name", ""))) for vol in vols]
+
+
+def details_nics(node, props):
+    """Get network interfaces of node concurrently, with their NSGs."""
+    nic_ids = [x['id'] for x in
+               props.get('networkProfile', {}).get('networkInterfaces', [])]
+    rows = []
+    for nic in Group().map(node.driver.ex_get_nic, nic_ids):
+        ips = [x['properties'].get('privateIPAddress')
+               for x in nic.extra.get('ipConfigurations', [])]
+        rows.append((nic.name, "{0} {1}".format(
+            ", ".join(x for x in ips if x), nic.extra.get("macAddress", ""))))
+        nsg = nic.extra.get('networkSecurityGroup')
+        if nsg:
+            rows.append(("security group", nsg['id'].split("/")[-1]))
+    return rows
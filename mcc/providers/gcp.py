@@ -0,0 +1,208 @@
+"""Google Compute Engine provider.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from mcc.cldcnct import abort_err  # imported first to apply monkey-patching
+from libcloud.compute.types import Provider
+from libcloud.compute.providers import get_driver
+from libcloud.common.types import InvalidCredsError
+from libcloud.common.exceptions import BaseHTTPError
+from requests.exceptions import SSLError
+from collections import OrderedDict
+from functools import partial
+from gevent.pool import Group
+from mcc.providers import ip_to_str, tags_to_dict, norm_run
+from mcc.confdir import CONFIG_DIR
+import re
+
+CLOUD_DISP = "GCP"
+ACTIONS = {"run": "ex_start_node", "stop": "ex_stop_node"}
+POLL = [1.0, 1.5, 10.0]
+
+CRED_REQUIRED = {"S": ["gcp_proj_id", "gcp_svc_acct_email", "gcp_pem_file"],
+                 "A": ["gcp_proj_id", "gcp_client_id", "gcp_client_sec"]}
+"""Required config entries for each gcp_auth_type."""
+
+
+def cred_keys(cred):
+    """Return required and optional config entries for auth type."""
+    gcp_auth_type = cred.get('gcp_auth_type', "S")
+    if gcp_auth_type not in CRED_REQUIRED:
+        raise ValueError("gcp_auth_type must be S or A, not '{0}'".
+                         format(gcp_auth_type))
+    return CRED_REQUIRED[gcp_auth_type], ["gcp_auth_type"]
+
+
+def connect(cred, crid):
+    """Establish connection to GCP."""
+    gcp_auth_type = cred.get('gcp_auth_type', "S")
+    if gcp_auth_type == "A":  # Application Auth
+        gcp_crd_ia = CONFIG_DIR + ".gcp_libcloud_a_auth." + cred['gcp_proj_id']
+        gcp_crd = {'user_id': cred['gcp_client_id'],
+                   'key': cred['gcp_client_sec'],
+                   'project': cred['gcp_proj_id'],
+                   'auth_type': "IA",
+                   'credential_file': gcp_crd_ia}
+    else:  # Service Account Auth
+        gcp_pem = CONFIG_DIR + cred['gcp_pem_file']
+        gcp_crd_sa = CONFIG_DIR + ".gcp_libcloud_s_auth." + cred['gcp_proj_id']
+        gcp_crd = {'user_id': cred['gcp_svc_acct_email'],
+                   'key': gcp_pem,
+                   'project': cred['gcp_proj_id'],
+                   'credential_file': gcp_crd_sa}
+    driver = get_driver(Provider.GCE)
+    try:
+        gcp_obj = driver(**gcp_crd)
+    except SSLError as e:
+        abort_err("\r SSL Error with GCP: {}".format(e))
+    except (InvalidCredsError, ValueError) as e:
+        abort_err("\r Error with GCP Credentials: {}".format(e))
+    return {crid: gcp_obj}
+
+
+def list_nodes(c_obj):
+    """Get node objects from GCP."""
+    gcp_nodes = []
+    try:
+        gcp_nodes = c_obj.list_nodes(ex_use_disk_cache=True)
+    except BaseHTTPError as e:
+        abort_err("\r HTTP Error with GCP: {}".format(e))
+    gcp_nodes = norm_run(normalize, gcp_nodes)
+    return gcp_nodes
+
+
+def normalize(gcp_nodes):
+    """Adjust details specific to GCP."""
+    for node in gcp_nodes:
+        node.cloud = "gcp"
+        node.cloud_disp = CLOUD_DISP
+        node.private_ips = ip_to_str(node.private_ips)
+        node.public_ips = ip_to_str(node.public_ips)
+        node.zone = node.extra['zone'].name
+        node.tags = tags_to_dict(node.extra.get('labels'))
+        node.group = None
+    return gcp_nodes
+
+
+def list_args(node_ids):
+    """Listing can't be limited to specific nodes."""
+    return {}
+
+
+def region(node):
+    """Calculate region from zone."""
+    return re.sub(r"-[a-z]$", "", node.zone or "")
+
+
+SSH_PROFILE_CACHE = False
+
+
+def ssh_prepare(nodes):
+    """No preparation required, profile uses node data only."""
+    return None
+
+
+def ssh_profile(node, context):
+    """Get ssh user from the 'ssh-keys' metadata entry."""
+    items = node.extra['metadata'].get('items', [])
+    keyname = next((item.get('value', "") for item in items
+                    if item.get('key') == 'ssh-keys'), "")
+    pos = keyname.find(":")
+    return {"key": "", "user": keyname[0:pos] if pos > 0 else ""}
+
+
+def details(node):
+    """Return detail sections, fetching image, disks and firewalls when called."""
+    extra = node.extra or {}
+    nics = [(x.get("name"), "{0} network {1} subnet {2}".format(
+        x.get("networkIP"), res_name(x.get("network")),
+        res_name(x.get("subnetwork"))))
+        for x in extra.get("networkInterfaces") or []]
+    tags = sorted(node.tags.items())
+    if extra.get("tags"):
+        tags.append(("network tags", ", ".join(extra["tags"])))
+    return OrderedDict([
+        ("Instance", [("id", extra.get("id")),
+                      ("created", extra.get("creationTimestamp")),
+                      ("cpu platform", extra.get("cpuPlatform")),
+                      ("preemptible", extra.get("scheduling", {}).
+                       get("preemptible")),
+                      ("service accounts", ", ".join(
+                          x["email"] for x in extra.get("serviceAccounts", [])))]),
+        ("Image", partial(details_image, node)),
+        ("Volumes", partial(details_volumes, node)),
+        ("Network Interfaces", nics),
+        ("Firewall Rules", partial(details_firewalls, node)),
+        ("Tags", tags),
+        ("Metadata", [(x["key"], x["value"]) for x in
+                      extra.get("metadata", {}).get("items", [])])])
+
+
+def res_name(url):
+    """Return resource name from resource url."""
+    return (url or "").split("/")[-1]
+
+
+def details_image(node):
+    """Get name & description of node's image."""
+    if not node.extra.get("image"):
+        return []
+    image = node.driver.ex_get_image(res_name(node.extra["image"]))
+    return [(image.name, image.extra.get("description"))]
+
+
+def details_volumes(node):
+    """Get disks attached to node concurrently."""
+    disks = node.extra.get("disks", [])
+    vols = Group().map(lambda x: node.driver.ex_get_volume(
+        res_name(x.get("source")), node.extra["zone"]), disks)
+    return [(disk.get("deviceName"), "{0} {1} GB {2}{3}".format(
+        vol.name, vol.size, vol.extra.get("type"),
+        " boot" if disk.get("boot") else ""))
+        for disk, vol in zip(disks, vols)]
+
+
+def details_firewalls(node):
+    """Get firewall rules applying to node's networks and network tags."""
+    networks = set(res_name(x.get("network")) for x in
+                   node.extra.get("networkInterfaces") or [])
+    tags = set(node.extra.get("tags") or [])
+    return [(rule.name, firewall_text(rule))
+            for rule in node.driver.ex_list_firewalls()
+            if firewall_applies(rule, networks, tags)]
+
+
+def firewall_applies(rule, networks, tags):
+    """Determine if firewall rule applies to networks and network tags."""
+    if rule.network.name not in networks:
+        return False
+    return not rule.target_tags or bool(tags.intersection(rule.target_tags))
+
+
+def firewall_text(rule):
+    """Describe ports allowed by firewall rule and their sources."""
+    allowed = ", ".join("{0}:{1}".format(x["IPProtocol"], ",".join(
+        x.get("ports", ["all"]))) for x in rule.allowed or [])
+    return "{0} from {1}".format(allowed or "deny",
+                                 ", ".join(rule.source_ranges or ["-"]))
@@ -0,0 +1,444 @@
+"""Simulated provider serving synthetic fleets for offline load testing.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+import mcc.cldcnct  # noqa - imported first to apply monkey-patching
+from builtins import range
+from libcloud.compute.base import Node, NodeImage, StorageVolume
+from libcloud.common.exceptions import BaseHTTPError
+from collections import OrderedDict
+from mcc.providers import prov_get
+from mcc.confread import cred_validate, config_errors
+import gevent
+import random
+import time
+
+SIM_CLOUDS = ["aws", "azure", "gcp", "alicloud"]
+"""Clouds a simulated section can stand in for."""
+
+SIM_DEFAULTS = OrderedDict([("sim_nodes", 250), ("sim_latency", 0.2),
+                            ("sim_page_size", 1000), ("sim_throttle", 0.0),
+                            ("sim_transition", 10.0), ("sim_churn", 0.0),
+                            ("sim_seed", 0)])
+"""Optional section entries and their defaults.
+
+latency is seconds per API request, throttle the fraction of requests
+rate limited, transition the seconds a start or stop takes and churn the
+fraction of nodes changing state outside mcc between listings."""
+
+SIM_INTS = ["sim_nodes", "sim_page_size", "sim_seed"]
+
+SIM_TOTAL = 1000
+"""Default fleet size for --simulate, split across the four clouds."""
+
+SIM_RETRIES = 3
+"""Throttled requests are retried with backoff, as provider SDKs do."""
+
+CLOUD_DISP = "Simulated"
+ACTIONS = {"run": "ex_start_node", "stop": "ex_stop_node"}
+POLL = [1.0, 1.5, 5.0]
+
+THROTTLE_MSG = {"aws": "RequestLimitExceeded: Request limit exceeded.",
+                "azure": "TooManyRequests: The request is being throttled.",
+                "gcp": "rateLimitExceeded: Rate Limit Exceeded",
+                "alicloud": "Throttling: Request was denied due to request"
+                            " throttling."}
+
+ZONES = {"aws": ["us-east-1a", "us-east-1b", "us-west-2a", "eu-west-1c"],
+         "azure": ["eastus", "westus2", "westeurope", "southeastasia"],
+         "gcp": ["us-central1-a", "us-east1-b", "europe-west1-d"],
+         "alicloud": ["cn-hangzhou-b", "cn-beijing-c", "ap-southeast-1a"]}
+
+SIZES = {"aws": ["t2.micro", "t3.medium", "m5.large", "c5.xlarge"],
+         "azure": ["Standard_B1s", "Standard_D2s_v3", "Standard_F4s_v2"],
+         "gcp": ["f1-micro", "n1-standard-1", "n1-standard-4"],
+         "alicloud": ["t5-lc1m1.small", "g5.large", "c5.xlarge"]}
+
+IMAGES = {"aws": [("ami-0sim00001", "ubuntu/images/hvm-ssd/ubuntu-bionic-"
+                   "18.04-amd64-server", "Canonical, Ubuntu, 18.04 LTS"),
+                  ("ami-0sim00002", "amzn2-ami-hvm-2.0-x86_64-gp2",
+                   "Amazon Linux 2 AMI"),
+                  ("ami-0sim00003", "CentOS Linux 7 x86_64 HVM EBS",
+                   "CentOS Linux 7")],
+          "azure": [("Canonical", "UbuntuServer", "18.04-LTS"),
+                    ("OpenLogic", "CentOS", "7.5")],
+          "gcp": [("ubuntu-1804-bionic-v20190404", "ubuntu-1804-bionic-"
+                   "v20190404", "Canonical, Ubuntu, 18.04 LTS"),
+                  ("debian-9-stretch-v20190326", "debian-9-stretch-v20190326",
+                   "Debian, Debian GNU/Linux, 9 (stretch)")],
+          "alicloud": [("ubuntu_18_04_64_20G_alibase_20190223.vhd",
+                        "Ubuntu 18.04 64 bit", "Ubuntu"),
+                       ("centos_7_06_64_20G_alibase_20190218.vhd",
+                        "CentOS 7.6 64 bit", "CentOS")]}
+"""Images as (id, name, description), Azure as (publisher, offer, sku)."""
+
+TAG_VALUES = OrderedDict([("env", ["prod", "stage", "dev"]),
+                          ("team", ["web", "data", "ops", "ml"]),
+                          ("role", ["web", "api", "db", "worker", "cache"])])
+
+
+def cred_keys(cred):
+    """Return required and optional config entries."""
+    if cred.get("sim_cloud") not in SIM_CLOUDS:
+        raise ValueError("sim_cloud must be one of: {0}".
+                         format(", ".join(SIM_CLOUDS)))
+    for key in SIM_DEFAULTS:
+        try:
+            sim_value(cred, key)
+        except ValueError:
+            raise ValueError("{0} must be a non-negative {1}number".format(
+                key, "whole " if key in SIM_INTS else ""))
+    return ["sim_cloud"], list(SIM_DEFAULTS)
+
+
+def sim_value(cred, key):
+    """Return numeric setting from section or its default."""
+    conv = int if key in SIM_INTS else float
+    value = conv(cred.get(key, SIM_DEFAULTS[key]))
+    if value < 0:
+        raise ValueError(key)
+    return value
+
+
+def sim_config(spec):
+    """Return (cred, providers, info) for a simulated fleet on all clouds.
+
+    spec is comma separated key=value settings applied to every cloud,
+    keys are the section entries without the 'sim_' prefix and nodes is
+    the total fleet size.
+    """
+    settings = {"sim_nodes": SIM_TOTAL}
+    for item in (x.strip() for x in spec.split(",") if x.strip()):
+        (key, unused, value) = item.partition("=")
+        settings["sim_" + key.strip()] = value.strip()
+    errors = cred_validate("sim", dict(settings, sim_cloud="aws"))
+    if errors:
+        config_errors([], ["--simulate {0}".format(x.replace("sim_", ""))
+                           for x in errors])
+    (per_cloud, extra) = divmod(sim_value(settings, "sim_nodes"),
+                                len(SIM_CLOUDS))
+    cred = OrderedDict()
+    for num, cloud in enumerate(SIM_CLOUDS):
+        cred["sim-" + cloud] = dict(settings, provider="sim", sim_cloud=cloud,
+                                    sim_nodes=per_cloud + (num < extra))
+    return cred, list(cred), {}
+
+
+def connect(cred, crid):
+    """Create simulated connection, taking one request's latency."""
+    settings = {x: sim_value(cred, x) for x in SIM_DEFAULTS}
+    gevent.sleep(settings["sim_latency"])
+    return {crid: SimDriver(cred["sim_cloud"], settings, crid)}
+
+
+def list_nodes(c_obj):
+    """Get nodes using the simulated cloud's provider for error handling."""
+    return prov_get(c_obj.cloud).list_nodes(c_obj)
+
+
+def normalize(nodes):
+    """Adjust details as the simulated cloud's provider does."""
+    if not nodes:
+        return nodes
+    return prov_get(nodes[0].driver.cloud).normalize(nodes)
+
+
+def list_args(node_ids):
+    """Limit node listing to node_ids."""
+    return {"ex_node_ids": node_ids}
+
+
+def region(node):
+    """Calculate region as the simulated cloud's provider does."""
+    return prov_get(node.driver.cloud).region(node)
+
+
+SSH_PROFILE_CACHE = False
+
+
+def ssh_prepare(nodes):
+    """Prepare as the simulated cloud's provider does."""
+    return prov_get(nodes[0].driver.cloud).ssh_prepare(nodes) if nodes else None
+
+
+def ssh_profile(node, context):
+    """Calculate profile as the simulated cloud's provider does."""
+    return prov_get(node.driver.cloud).ssh_profile(node, context)
+
+
+def details(node):
+    """Return detail sections from the simulated cloud's provider."""
+    return prov_get(node.driver.cloud).details(node)
+
+
+class SimRes(object):
+    """Simulated resource with attributes set from keyword arguments."""
+
+    def __init__(self, **attrs):
+        """Set attributes."""
+        self.__dict__.update(attrs)
+
+
+class SimDriver(object):
+    """Stand-in for a libcloud driver, serving a synthetic fleet.
+
+    Nodes normalize as the simulated cloud (node.cloud is 'aws' etc), so
+    that cloud's provider module handles them, calling the methods of
+    its libcloud driver implemented here.  Every API call waits the
+    configured latency and may be throttled.  Starts and stops pass
+    through pending / stopping states for the transition time.
+    """
+
+    def __init__(self, cloud, settings, crid):
+        """Generate fleet for cloud."""
+        self.cloud = cloud
+        self.settings = settings
+        seed = u"{0}:{1}".format(settings["sim_seed"], crid)
+        self.rand = random.Random(seed)  # nosec - simulated data only
+        self.fleet = [fleet_member(cloud, crid, num, self.rand)
+                      for num in range(settings["sim_nodes"])]
+        self.by_id = {x["id"]: x for x in self.fleet}
+        self.by_name = {x["name"]: x for x in self.fleet}
+        self.pending = {}
+        """Nodes in transition, node-id: (final-state, completion-time)."""
+
+    def request(self):
+        """Simulate one API request's latency and throttling."""
+        for attempt in range(SIM_RETRIES + 1):
+            delay = self.settings["sim_latency"]
+            gevent.sleep(delay * self.rand.uniform(0.75, 1.25))
+            if self.rand.random() >= self.settings["sim_throttle"]:
+                return
+            gevent.sleep(0.1 * 2 ** attempt)
+        raise BaseHTTPError(429, THROTTLE_MSG[self.cloud])
+
+    def list_nodes(self, ex_node_ids=None, **kwargs):
+        """List nodes with one request per page."""
+        self.transitions_apply()
+        if ex_node_ids is None:
+            self.churn_apply()
+            members = self.fleet
+        else:
+            members = [self.by_id[x] for x in ex_node_ids if x in self.by_id]
+        page_size = max(self.settings["sim_page_size"], 1)
+        nodes = []
+        for start in range(0, max(len(members), 1), page_size):
+            self.request()
+            nodes.extend(self.node_make(x)
+                         for x in members[start:start + page_size])
+        return nodes
+
+    def transitions_apply(self):
+        """Complete state transitions that are due."""
+        now = time.time()
+        for node_id, (state, due) in list(self.pending.items()):
+            if due <= now:
+                self.by_id[node_id]["state"] = state
+                del self.pending[node_id]
+
+    def churn_apply(self):
+        """Start or stop a fraction of nodes, as if done outside mcc."""
+        count = int(len(self.fleet) * self.settings["sim_churn"])
+        for member in self.rand.sample(self.fleet, count):
+            if member["id"] not in self.pending:
+                member["state"] = ("stopped" if member["state"] == "running"
+                                   else "running")
+
+    def transition(self, node, from_state, via_state, to_state):
+        """Send action request, starting transition if node is in from_state."""
+        self.request()
+        self.transitions_apply()
+        member = self.by_id[node.id]
+        if member["state"] != from_state:
+            return False
+        member["state"] = via_state
+        due = time.time() + self.settings["sim_transition"]
+        self.pending[node.id] = (to_state, due)
+        return True
+
+    def ex_start_node(self, node):
+        """Start node."""
+        return self.transition(node, "stopped", "pending", "running")
+
+    def ex_stop_node(self, node):
+        """Stop node."""
+        return self.transition(node, "running", "stopping", "stopped")
+
+    def node_make(self, member):
+        """Create libcloud node with the simulated cloud's extra data."""
+        extra = EXTRA_FN[self.cloud](member)
+        public_ips = [member["public_ip"]] if member["public_ip"] else []
+        return Node(member["id"], member["name"], member["state"], public_ips,
+                    [member["private_ip"]], self, size=member["size"],
+                    extra=extra)
+
+    def list_images(self, ex_image_ids=None):
+        """List images, limited to ex_image_ids."""
+        self.request()
+        return [NodeImage(x[0], x[1], self, extra={"description": x[2]})
+                for x in IMAGES[self.cloud]
+                if ex_image_ids is None or x[0] in ex_image_ids]
+
+    def get_image(self, image_id):
+        """Get image by id."""
+        return next(iter(self.list_images([image_id])), None)
+
+    def ex_get_image(self, name):
+        """Get image by name (GCP)."""
+        return self.get_image(name)
+
+    def list_volumes(self, node=None, ex_filters=None):
+        """List volumes of node (AWS) or filtered by InstanceId (AliCloud)."""
+        self.request()
+        node_id = node.id if node else (ex_filters or {}).get("InstanceId")
+        extra = ({"device": "/dev/xvda", "volume_type": "gp2"}
+                 if self.cloud == "aws" else
+                 {"device": "/dev/xvda", "category": "cloud_efficiency"})
+        return [StorageVolume("vol-{0}".format(node_id), "root", 20, self,
+                              extra=extra)]
+
+    def ex_get_volume(self, volume_id, zone=None):
+        """Get volume by id (Azure) or by name and zone (GCP)."""
+        self.request()
+        name = volume_id.rsplit("/", 1)[-1]
+        extra = ({"type": "pd-standard"} if self.cloud == "gcp" else
+                 {"sku": {"name": "Premium_LRS"}})
+        return StorageVolume(volume_id, name, 30, self, extra=extra)
+
+    def ex_get_nic(self, nic_id):
+        """Get network interface by id (Azure)."""
+        self.request()
+        name = nic_id.rsplit("/", 1)[-1]
+        member = self.by_name.get(name[:-len("-nic")], {})
+        config = {"properties": {"privateIPAddress": member.get("private_ip")}}
+        nsg_id = nic_id.replace("networkInterfaces/" + name,
+                                "networkSecurityGroups/sim-nsg")
+        return SimRes(id=nic_id, name=name, extra={
+            "ipConfigurations": [config], "macAddress": "00-0D-3A-00-00-00",
+            "networkSecurityGroup": {"id": nsg_id}})
+
+    def ex_list_firewalls(self):
+        """List firewall rules (GCP)."""
+        self.request()
+        network = SimRes(name="default")
+        return [SimRes(name="default-allow-ssh", network=network,
+                       target_tags=[], source_ranges=["0.0.0.0/0"],
+                       allowed=[{"IPProtocol": "tcp", "ports": ["22"]}]),
+                SimRes(name="allow-http", network=network,
+                       target_tags=["web"], source_ranges=["0.0.0.0/0"],
+                       allowed=[{"IPProtocol": "tcp", "ports": ["80", "443"]}])]
+
+
+def fleet_member(cloud, crid, num, rand):
+    """Generate data for one simulated node."""
+    tags = OrderedDict((k, rand.choice(v)) for k, v in TAG_VALUES.items())
+    name = "{0}-{1}-{2}-{3:05d}".format(crid, tags["env"], tags["role"], num)
+    node_ids = {"aws": "i-{0:017x}".format(rand.getrandbits(68)),
+                "azure": "/subscriptions/00000000-0000-0000-0000-000000000000"
+                         "/resourceGroups/rg-{0}/providers/Microsoft.Compute"
+                         "/virtualMachines/{1}".format(tags["team"], name),
+                "gcp": str(rand.getrandbits(63)),
+                "alicloud": "i-sim{0:016x}".format(rand.getrandbits(64))}
+    public = rand.random() < 0.4
+    return {"id": node_ids[cloud], "name": name, "tags": dict(tags),
+            "state": "running" if rand.random() < 0.7 else "stopped",
+            "zone": rand.choice(ZONES[cloud]),
+            "size": rand.choice(SIZES[cloud]),
+            "image": rand.choice(IMAGES[cloud]),
+            "private_ip": "10.{0}.{1}.{2}".format(num >> 16, (num >> 8) & 255,
+                                                  num & 255),
+            "public_ip": "203.0.{0}.{1}".format((num >> 8) & 255, num & 255)
+                         if public else None,
+            "created": "2018-{0:02d}-{1:02d}T12:00:00.000Z".format(
+                rand.randint(1, 12), rand.randint(1, 28))}
+
+
+def extra_aws(member):
+    """Return EC2 driver style extra data."""
+    return {"availability": member["zone"], "instance_type": member["size"],
+            "instance_lifecycle": None, "tags": member["tags"],
+            "image_id": member["image"][0],
+            "key_name": "sim-{0}".format(member["tags"]["team"]),
+            "launch_time": member["created"], "vpc_id": "vpc-0sim",
+            "subnet_id": "subnet-0sim", "network_interfaces": [],
+            "groups": [{"group_id": "sg-0sim", "group_name":
+                        member["tags"]["role"]}]}
+
+
+def extra_azure(member):
+    """Return Azure ARM driver style extra data."""
+    res_base = member["id"].split("/providers/")[0]
+    image = member["image"]
+    return {"location": member["zone"], "tags": member["tags"],
+            "properties": {
+                "vmId": member["name"], "timeCreated": member["created"],
+                "hardwareProfile": {"vmSize": member["size"]},
+                "osProfile": {"adminUsername": "azureuser"},
+                "storageProfile": {
+                    "imageReference": {"publisher": image[0],
+                                       "offer": image[1], "sku": image[2],
+                                       "version": "latest"},
+                    "osDisk": {"osType": "Linux", "managedDisk": {
+                        "id": "{0}/providers/Microsoft.Compute/disks/{1}-os".
+                        format(res_base, member["name"])}},
+                    "dataDisks": []},
+                "networkProfile": {"networkInterfaces": [{
+                    "id": "{0}/providers/Microsoft.Network/networkInterfaces/"
+                          "{1}-nic".format(res_base, member["name"])}]}}}
+
+
+def extra_gcp(member):
+    """Return GCE driver style extra data."""
+    url = "https://www.googleapis.com/compute/v1/projects/"
+    return {"id": member["id"], "zone": SimRes(name=member["zone"]),
+            "labels": member["tags"], "tags": [member["tags"]["role"]],
+            "creationTimestamp": member["created"],
+            "cpuPlatform": "Intel Skylake", "scheduling": {"preemptible": False},
+            "serviceAccounts": [],
+            "metadata": {"items": [{"key": "ssh-keys",
+                                    "value": "gceuser:ssh-rsa AAAAsim"}]},
+            "image": "{0}sim/global/images/{1}".format(url, member["image"][0]),
+            "disks": [{"deviceName": "persistent-disk-0", "boot": True,
+                       "source": "{0}sim/zones/{1}/disks/{2}".format(
+                           url, member["zone"], member["name"])}],
+            "networkInterfaces": [{
+                "networkIP": member["private_ip"],
+                "network": url + "sim/global/networks/default",
+                "subnetwork": url + "sim/regions/sim/subnetworks/default"}]}
+
+
+def extra_alicloud(member):
+    """Return ECS driver style extra data."""
+    return {"zone_id": member["zone"], "instance_type": "ecs." + member["size"],
+            "tags": member["tags"], "image_id": member["image"][0],
+            "creation_time": member["created"], "hostname": member["name"],
+            "instance_charge_type": "PostPaid", "expired_time": None,
+            "vpc_attributes": {"private_ip_address": [member["private_ip"]],
+                               "vpc_id": "vpc-sim", "vswitch_id": "vsw-sim"},
+            "eip_address": {"ip_address": member["public_ip"] or ""},
+            "security_group_ids": ["sg-sim"]}
+
+
+EXTRA_FN = {"aws": extra_aws, "azure": extra_azure, "gcp": extra_gcp,
+            "alicloud": extra_alicloud}
@@ -0,0 +1,146 @@
+"""Calculate fleet count, capacity and cost rollups from node data.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from mcc.confdir import CONFIG_DIR
+from mcc.nodeidx import INDEX_FIELDS
+from mcc.providers import node_prov
+import csv
+import io
+import json
+import sys
+
+CATALOG_FILE = u"{0}catalog.json".format(CONFIG_DIR)
+"""Local size & price catalog, created from the packaged sample.
+
+Format: {cloud: {size: {"vcpu": n, "ram": gb, "price": hourly-usd,
+"regions": {region: hourly-usd}}}}.  The "regions" entry is optional
+and overrides "price" for nodes in the listed regions.
+"""
+
+ROLLUP_COLS = ["COUNT", "RUNNING", "VCPU", "RAM GB", "EST $/HR", "UNPRICED"]
+"""Columns of each rollup row.  Cost includes running nodes only."""
+
+
+def catalog_load():
+    """Read size catalog from config dir, or packaged sample if missing."""
+    try:
+        with io.open(CATALOG_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except IOError:
+        from pkg_resources import resource_string
+        return json.loads(resource_string("mcc", "catalog.json").
+                          decode('utf-8'))
+    except ValueError as e:
+        print("Error reading catalog file {0}: {1}".format(CATALOG_FILE, e))
+        sys.exit()
+
+
+def catalog_import(filename):
+    """Merge size data from JSON or CSV file into local catalog.
+
+    CSV files require the columns cloud, size, vcpu, ram and price, and
+    may include region to set a region specific price.
+    """
+    catalog = catalog_load()
+    try:
+        with io.open(filename, encoding='utf-8') as f:
+            if filename.lower().endswith(".csv"):
+                new_data = catalog_from_csv(f)
+            else:
+                new_data = json.load(f)
+    except (IOError, ValueError, KeyError) as e:
+        print("Error importing catalog file {0}: {1}".format(filename, e))
+        sys.exit()
+    for cloud, sizes in new_data.items():
+        for size, info in sizes.items():
+            entry = catalog.setdefault(cloud, {}).setdefault(size, {})
+            regions = info.pop("regions", {})
+            entry.update(info)
+            entry.setdefault("regions", {}).update(regions)
+    with io.open(CATALOG_FILE, "w", encoding='utf-8') as f:
+        f.write(u"{0}".format(json.dumps(catalog, indent=2, sort_keys=True)))
+    print("Catalog updated: {0}".format(CATALOG_FILE))
+
+
+def catalog_from_csv(csv_file):
+    """Convert CSV rows to catalog format."""
+    catalog = {}
+    for row in csv.DictReader(csv_file):
+        entry = catalog.setdefault(row["cloud"], {}).setdefault(
+            row["size"], {"vcpu": float(row["vcpu"]), "ram": float(row["ram"])})
+        if row.get("region"):
+            entry.setdefault("regions", {})[row["region"]] = float(row["price"])
+        else:
+            entry["price"] = float(row["price"])
+    return catalog
+
+
+def rollup_calc(node_dict, nums, keys, catalog=None):
+    """Calculate rollups for keys in one pass over nodes.
+
+    keys are node fields, "region", or tag-names (optionally prefixed
+    with "tag.").  Returns {key: {value: [count, running, vcpu, ram,
+    cost, unpriced]}}.
+    """
+    catalog = catalog_load() if catalog is None else catalog
+    rollups = OrderedDict((key, {}) for key in keys)
+    getters = [(key, rollup_getter(key)) for key in keys]
+    for num in nums:
+        node = node_dict[num]
+        region = node_prov(node).region(node)
+        vals = rollup_values(node, region, catalog)
+        for key, getter in getters:
+            rollup_add(rollups[key], getter(node, region) or "-", vals)
+    for key in keys:
+        rollups[key] = OrderedDict(sorted(rollups[key].items()))
+    return rollups
+
+
+def rollup_values(node, region, catalog):
+    """Return node's [count, running, vcpu, ram, cost, unpriced] values."""
+    info = catalog.get(node.cloud, {}).get(node.size)
+    running = int(node.state == "running")
+    if not info:
+        return [1, running, 0, 0, 0, 1]
+    price = info.get("regions", {}).get(region, info.get("price", 0))
+    return [1, running, info["vcpu"], info["ram"], price * running, 0]
+
+
+def rollup_add(totals, value, vals):
+    """Add node's values to the totals for value."""
+    total = totals.setdefault(value, [0] * len(vals))
+    for i, val in enumerate(vals):
+        total[i] += val
+
+
+def rollup_getter(key):
+    """Return function to get value of rollup key from node."""
+    if key == "region":
+        return lambda node, region: region
+    if key in INDEX_FIELDS:
+        return lambda node, region: getattr(node, key, None)
+    tag = key[len("tag."):] if key.startswith("tag.") else key
+    return lambda node, region: node.tags.get(tag)
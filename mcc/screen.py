@@ -0,0 +1,186 @@
+"""Buffered terminal output with in-place redraw of changed lines.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from blessed import Terminal
+from mcc.metrics import counter_inc
+import re
+import sys
+
+term = Terminal()
+
+out_buf = []
+"""Text written since the last flush."""
+
+frame = {"lines": []}
+"""Lines of the frame on screen, above the line holding the cursor."""
+
+cursor = {"row": 0, "col": 0}
+"""Cursor position within the line below the frame, which may wrap."""
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+LINE_RE = re.compile(r"\x1b\[(\d*)D|\x1b(?:\[[0-9;?]*[A-Za-z]|[()][A-Za-z0-9]|.)"
+                     r"|\r|\n|[^\x1b\r\n]+")
+
+
+def out_write(text):
+    """Add text to output buffer."""
+    out_buf.append(text)
+
+
+def out_flush():
+    """Send buffered output to the terminal in one write."""
+    if not out_buf:
+        return
+    data = "".join(out_buf)
+    del out_buf[:]
+    sys.stdout.write(data)
+    sys.stdout.flush()
+    counter_inc("mcc_tty_writes_total")
+    counter_inc("mcc_tty_bytes_total", len(data))
+
+
+def line_write(text):
+    """Add text for the cursor line to output buffer, tracking wrapping."""
+    out_write(text)
+    if term.save:  # save/restore pairs leave the cursor in place
+        text = re.sub(re.escape(term.save) + ".*?" + re.escape(term.restore),
+                      "", text, flags=re.S)
+    for match in LINE_RE.finditer(text):
+        line_track(match.group(0), match.group(1))
+
+
+def line_track(seq, back):
+    """Update cursor position after writing seq."""
+    width = max(term.width, 1)
+    if seq == "\r":
+        cursor["col"] = 0
+    elif seq == "\n":
+        cursor.update(row=0, col=0)
+    elif back is not None:
+        col = min(cursor["col"], width - 1) - int(back or 1)
+        cursor["col"] = max(col, 0)
+    elif not seq.startswith("\x1b"):
+        total = cursor["col"] + len(seq)
+        rows = (total - 1) // width if total else 0
+        cursor["row"] += rows
+        cursor["col"] = total - rows * width
+
+
+def text_width(text):
+    """Return displayed width of text, ignoring color sequences."""
+    return len(ANSI_RE.sub("", text))
+
+
+def move_up(num):
+    """Return sequence moving cursor up num lines."""
+    return term.cuu(num) if num > 0 else ""
+
+
+def move_down(num):
+    """Return sequence moving cursor down num existing lines."""
+    return term.cud(num) if num > 0 else ""
+
+
+def move_col(col):
+    """Return sequence moving cursor to column col of current line."""
+    return "\r" + (term.cuf(col) if col > 0 else "")
+
+
+def erase_ln():
+    """Erase current line, including rows it wrapped onto, return to its start."""
+    out_write("\r" + move_up(cursor["row"]) + term.clear_eos)
+    cursor.update(row=0, col=0)
+
+
+def erase_up(num_lines):
+    """Erase current line and num_lines above, leaving cursor at top."""
+    out_write("\r" + move_up(num_lines) + term.clear_eos)
+
+
+def frame_draw(lines, keep_cursor=False):
+    """Update frame above cursor to lines, sending only changed lines.
+
+    The cursor is left at the start of the line below the frame, which
+    is cleared, unless keep_cursor is set.  keep_cursor updates frames
+    of the same length from the background without disturbing input
+    on the cursor line.
+    """
+    old = frame["lines"] if term.does_styling else []
+    if keep_cursor:
+        if not old or len(lines) != len(old):
+            return
+        out_write(term.save)
+    (old, reach) = frame_top(old, keep_cursor)
+    row = frame_lines(lines, old, reach)
+    if keep_cursor:
+        out_write(term.restore)
+        frame["lines"] = old[:reach] + lines[reach:]
+    else:
+        out_write(frame_goto(row, len(lines), len(old)) + term.clear_eos)
+        frame["lines"] = list(lines)
+        cursor.update(row=0, col=0)
+
+
+def frame_top(old, keep_cursor):
+    """Move to the first line of frame old on screen, return (old, reach).
+
+    reach is the number of lines scrolled off the top.  Frames taller
+    than the screen are erased to be redrawn, unless keep_cursor is set.
+    """
+    below = cursor["row"]  # rows of a wrapped cursor line above cursor
+    reach = max(len(old) + below - term.height + 1, 0)  # lines scrolled off top
+    if reach and not keep_cursor:
+        erase_up(len(old) + below - reach)  # can't update in place, redraw all
+        return [], 0
+    out_write("\r" + move_up(len(old) + below - reach))
+    return old, reach
+
+
+def frame_lines(lines, old, reach):
+    """Write lines differing from old, return the last frame row written."""
+    row = reach
+    for num in range(reach, len(lines)):
+        if num < len(old) and old[num] == lines[num]:
+            continue
+        out_write(frame_goto(row, num, len(old)))
+        out_write(lines[num] + term.clear_eol)
+        row = num
+    return row
+
+
+def frame_goto(row, num, old_len):
+    """Return sequence moving from frame line row to line num.
+
+    Existing lines are reached by cursor movement, lines beyond them
+    with newlines so the terminal scrolls if required.
+    """
+    existing = max(min(num, old_len) - row, 0)
+    new = num - max(row, old_len) if num > max(row, old_len) else 0
+    return "\r" + move_down(existing) + "\n" * new
+
+
+def frame_reset():
+    """Forget frame after output scrolled it, next frame is drawn below."""
+    frame["lines"] = []
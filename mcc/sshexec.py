@@ -0,0 +1,284 @@
+"""Build ssh commands and execute commands on multiple nodes in parallel.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+import configparser
+from collections import OrderedDict
+from fnmatch import fnmatch
+from gevent.pool import Pool
+from gevent import subprocess
+from mcc.confdir import CONFIG_DIR
+from mcc.providers import prov_get, node_prov
+from mcc.colors import C_NORM, C_TI, C_GOOD, C_ERR, C_WARN
+import mcc.nodeidx as nodeidx
+import json
+import os
+import re
+import sys
+import time
+
+SSH_POOL_SIZE = 10
+"""Maximum number of simultaneous ssh sessions during bulk execution."""
+
+SSH_CONNECT_TIMEOUT = "10"
+"""Seconds ssh waits to connect during bulk execution, so unreachable
+nodes don't hold a session until the system timeout."""
+
+SSH_PERSIST = "60"
+"""Default seconds a multiplexed master connection stays open when idle.
+
+The first session to a host becomes the master connection and later
+sessions to the same host re-use it, skipping the handshake and
+authentication.
+"""
+
+PROFILE_FILE = u"{0}ssh_profiles.json".format(CONFIG_DIR)
+"""Persisted connection profiles calculated from provider data."""
+
+OVERRIDE_FILE = u"{0}ssh.ini".format(CONFIG_DIR)
+"""Optional user overrides for connection profiles.
+
+Sections are applied in order of increasing precedence:
+[default], [image:<pattern>], [tag:<key>=<value>] and [node:<name>].
+Each may set user, key, jump (bastion as [user@]host[:port]) and persist.
+"""
+
+PROFILE_KEYS = ("user", "key", "jump", "persist")
+
+OVERRIDE_ORDER = ("default", "image", "tag", "node")
+"""Override section types in increasing precedence."""
+
+ssh_profiles = {}
+"""Connection profiles for current nodes, keyed by node id."""
+
+
+def profiles_build(node_dict, persist=True):
+    """Calculate connection profiles for nodes, re-using persisted ones.
+
+    Persisted profiles are re-used for providers that require API calls
+    to calculate them (SSH_PROFILE_CACHE) if the node image is unchanged.
+    Persisted profiles are neither used nor replaced if persist is False.
+    """
+    cached = profiles_load() if persist else {}
+    overrides = overrides_read()
+    profiles_calc(node_dict, cached)
+    ssh_profiles.clear()
+    for node in node_dict.values():
+        profile = dict(cached[node.id])
+        for section in overrides_match(node, profile, overrides):
+            profile.update(section)
+        ssh_profiles[node.id] = profile
+    if persist:
+        profiles_save({x.id: cached[x.id] for x in node_dict.values()})
+    return ssh_profiles
+
+
+def profiles_calc(node_dict, cached):
+    """Calculate profiles of nodes missing or stale in cached.
+
+    Nodes are prepared together per cloud, so providers can collect
+    data for all nodes in a few calls.
+    """
+    pending = {}
+    for node in node_dict.values():
+        if profile_stale(node, cached.get(node.id, {})):
+            pending.setdefault(node.cloud, []).append(node)
+    for cloud, nodes in pending.items():
+        context = prov_get(cloud).ssh_prepare(nodes)
+        for node in nodes:
+            cached[node.id] = ssh_get_info(node, context)
+
+
+def profile_stale(node, profile):
+    """Determine if persisted profile must be re-calculated for node."""
+    if not node_prov(node).SSH_PROFILE_CACHE:
+        return True
+    return profile.get("image") != node.extra.get("image_id")
+
+
+def profiles_load():
+    """Read persisted connection profiles."""
+    try:
+        with open(PROFILE_FILE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def profiles_save(profiles):
+    """Persist connection profiles, ignore failures as cache is optional."""
+    try:
+        with open(PROFILE_FILE, "w") as f:
+            json.dump(profiles, f)
+    except IOError:
+        pass
+
+
+def profile_get(node):
+    """Return connection profile for node, calculate if not pre-built."""
+    if node.id not in ssh_profiles:
+        ssh_profiles[node.id] = ssh_get_info(node)
+    return ssh_profiles[node.id]
+
+
+def overrides_read():
+    """Read override sections from optional override file."""
+    config = configparser.ConfigParser(allow_no_value=True)
+    try:
+        config.read(OVERRIDE_FILE, encoding='utf-8')
+    except (IOError, configparser.Error) as e:
+        print("Error reading ssh override file: {}".format(e))
+    return OrderedDict((name, {k: v for k, v in config[name].items()
+                               if k in PROFILE_KEYS})
+                       for name in config.sections())
+
+
+def overrides_match(node, profile, overrides):
+    """Return override sections applying to node in precedence order."""
+    image = profile.get("image_name") or ""
+    matched = [x for x in overrides if override_applies(x, node, image)]
+    matched.sort(key=lambda x: OVERRIDE_ORDER.index(x.partition(":")[0]))
+    return [overrides[x] for x in matched]
+
+
+def override_applies(name, node, image):
+    """Determine if override section applies to node with image name."""
+    (sec_type, unused, pattern) = name.partition(":")
+    if sec_type == "image":
+        return fnmatch(image.lower(), pattern.lower())
+    if sec_type == "tag":
+        tags = getattr(node, "tags", {})
+        (key, unused, value) = pattern.partition("=")
+        return key in tags and fnmatch(tags[key], value or "*")
+    if sec_type == "node":
+        return fnmatch(node.name, pattern)
+    return sec_type == "default"
+
+
+def ssh_get_info(node, context=None):
+    """Determine connection profile for node from provider data."""
+    prov = node_prov(node)
+    if context is None:
+        context = prov.ssh_prepare([node])
+    profile = {"image": node.extra.get("image_id")}
+    profile.update(prov.ssh_profile(node, context))
+    return profile
+
+
+def ssh_build_args(node, extra_opts=None):
+    """Create ssh argument list for node, optionally adding options."""
+    profile = profile_get(node)
+    ssh_args = ["ssh", "-o", "ControlMaster=auto",
+                "-o", "ControlPath={0}.ssh-mux-%C".format(CONFIG_DIR),
+                "-o", "ControlPersist={0}".format(
+                    profile.get("persist") or SSH_PERSIST)]
+    ssh_args += extra_opts or []
+    if profile.get("jump"):
+        ssh_args += ["-J", profile["jump"]]
+    if profile.get("key"):
+        ssh_args += ["-i", os.path.expanduser(profile["key"])]
+    if profile.get("user"):
+        ssh_args.append("{0}@{1}".format(profile["user"], node.public_ips))
+    else:
+        ssh_args.append(node.public_ips)
+    return ssh_args
+
+
+def nodes_select(node_dict, sel_str):
+    """Return node numbers matching a selection string.
+
+    The selection is a space or comma separated list of terms: node
+    numbers ('3'), ranges ('2-5'), 'all', or query terms as used by
+    --query ('cloud=aws', 'name=web*', 'env!=prod').  Nodes matching
+    all query terms are combined with the numbers and ranges.  Raises
+    ValueError for a term that is none of these.
+    """
+    nums = set()
+    terms = []
+    for term in sel_str.replace(",", " ").split():
+        selected = select_nums(term, node_dict)
+        if selected is not None:
+            nums.update(selected)
+        elif nodeidx.term_split(term)[1]:
+            terms.append(term)
+        else:
+            raise ValueError(term)
+    if terms:
+        nums.update(nodeidx.index_query(nodeidx.index_build(node_dict),
+                                        " ".join(terms)))
+    return sorted(x for x in nums if x in node_dict)
+
+
+def select_nums(term, node_dict):
+    """Return node numbers for a number, range or 'all', else None."""
+    if term.lower() == "all":
+        return set(node_dict)
+    match = re.match(r"^(\d+)(?:-(\d+))?$", term)
+    if not match:
+        return None
+    (first, last) = (int(match.group(1)), int(match.group(2) or match.group(1)))
+    return set(x for x in node_dict if first <= x <= last)
+
+
+def run_bulk(nodes, command, pool_size=SSH_POOL_SIZE):
+    """Run command on nodes concurrently and print summary."""
+    targets = [node for node in nodes
+               if node.state == "running" and node.public_ips]
+    skipped = len(nodes) - len(targets)
+    pool = Pool(pool_size)
+    start = time.time()
+    results = pool.map(lambda node: run_node(node, command), targets)
+    bulk_summary(results, skipped, time.time() - start)
+    return results
+
+
+def run_node(node, command):
+    """Execute command on node, stream output and return (node, exit-code)."""
+    # -n keeps sessions off the terminal's stdin, which they'd share
+    ssh_args = ssh_build_args(node, [
+        "-n", "-o", "BatchMode=yes",
+        "-o", "ConnectTimeout={0}".format(SSH_CONNECT_TIMEOUT)]) + [command]
+    prefix = "{0}[{1}]{2} ".format(C_TI, node.name, C_NORM)
+    try:
+        proc = subprocess.Popen(ssh_args, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+    except OSError as e:
+        sys.stdout.write("{0}{1}{2}{3}\n".format(prefix, C_ERR, e, C_NORM))
+        return node, -1
+    for line in iter(proc.stdout.readline, b''):
+        sys.stdout.write("{0}{1}\n".format(
+            prefix, line.decode("utf-8", "replace").rstrip()))
+        sys.stdout.flush()
+    return node, proc.wait()
+
+
+def bulk_summary(results, skipped, elapsed):
+    """Print result totals and names of nodes with failures."""
+    failed = [node.name for node, code in results if code != 0]
+    print("\n{0}{1} succeeded{2}, {3}{4} failed{2}, {5}{6} skipped{2}"
+          " (not running or no public ip) in {7:.1f}s".
+          format(C_GOOD, len(results) - len(failed), C_NORM, C_ERR,
+                 len(failed), C_WARN, skipped, elapsed))
+    if failed:
+        print("Failed: {0}".format(", ".join(failed)))
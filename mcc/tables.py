@@ -23,12 +23,16 @@ Author:    Robert Peteuil
 
 """
 from __future__ import absolute_import, print_function
-from mcc.colors import C_NORM, C_TI, C_STAT, C_WARN
+from mcc.colors import C_NORM, C_TI, C_STAT, C_WARN, C_GOOD, C_ERR
 from prettytable import PrettyTable
+from datetime import datetime
 
 
-def indx_table(node_dict, tbl_mode=False):
-    """Print Table for dict=formatted list conditionally include numbers."""
+def indx_table(node_dict, tbl_mode=False, ret=False):
+    """Print Table for dict=formatted list conditionally include numbers.
+
+    The table is returned instead of printed in tbl_mode or if ret is set.
+    """
     nt = PrettyTable()
     nt.header = False
     nt.padding_width = 2
@@ -53,8 +57,104 @@ def indx_table(node_dict, tbl_mode=False):
                 False: [node.name, node.zone, node.cloud,
                         node.size, n_ip, state]}
         nt.add_row(r_lu[tbl_mode])
-    if not tbl_mode:
+    if not (tbl_mode or ret):
         print(nt)
     else:
         idx_tbl = nt.get_string()
         return idx_tbl
+
+
+def group_table(groups, group_by):
+    """Print Table summarizing node count and sizes for each group."""
+    nt = PrettyTable()
+    nt.header = False
+    nt.padding_width = 2
+    nt.border = False
+    nt.add_row([C_TI + group_by.upper(), "COUNT", "SIZES" + C_NORM])
+    for value, (count, sizes) in groups.items():
+        size_str = ", ".join("{0} x{1}".format(size, qty) for size, qty in
+                             sorted(sizes.items()))
+        nt.add_row([value, count, size_str])
+    nt.align = "l"
+    print(nt)
+
+
+def rollup_table(rollups, columns):
+    """Print Table of totals for each value of each rollup key."""
+    for key, rows in rollups.items():
+        nt = PrettyTable()
+        nt.header = False
+        nt.padding_width = 2
+        nt.border = False
+        title = [C_TI + key.upper()] + list(columns)
+        title[-1] += C_NORM
+        nt.add_row(title)
+        for value, totals in rows.items():
+            (count, running, vcpu, ram, cost, unpriced) = totals
+            nt.add_row([value, count, running, "{0:g}".format(vcpu),
+                        "{0:g}".format(ram), "{0:.2f}".format(cost),
+                        unpriced])
+        nt.align = "r"
+        nt.align[nt.field_names[0]] = "l"
+        print("{0}\n".format(nt))
+
+
+def history_table(rows):
+    """Print Table of recorded node changes."""
+    nt = PrettyTable()
+    nt.header = False
+    nt.padding_width = 2
+    nt.border = False
+    nt.add_row([C_TI + "TIME", "NAME", "CLOUD", "CHANGE", "FIELD",
+                "FROM", "TO" + C_NORM])
+    for (ts, name, cloud, change, field, old, new) in rows:
+        if field == "state":
+            old = C_STAT.get(old, C_NORM) + old + C_NORM if old else "-"
+            new = C_STAT.get(new, C_NORM) + new + C_NORM if new else "-"
+        nt.add_row([datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"),
+                    name, cloud, change, field, old or "-", new or "-"])
+    nt.align = "l"
+    print(nt)
+
+
+def details_table(sections, max_len=70):
+    """Print Table of node details grouped by section."""
+    nt = PrettyTable()
+    nt.header = False
+    nt.padding_width = 2
+    nt.border = False
+    for title, rows in sections.items():
+        if not rows:
+            continue
+        nt.add_row([C_TI + title.upper() + C_NORM, ""])
+        for label, value in rows:
+            value = "-" if value is None or value == "" else u"{0}".format(value)
+            if len(value) > max_len:
+                value = value[:max_len - 3] + "..."
+            nt.add_row(["  {0}".format(label), value])
+    nt.align = "l"
+    print(nt)
+
+
+def plan_table(plan, results=None):
+    """Print Table of planned policy actions, with their results if run."""
+    nt = PrettyTable()
+    nt.header = False
+    nt.padding_width = 2
+    nt.border = False
+    title = [C_TI + "POLICY", "NAME", "CLOUD", "STATE", "ACTION"]
+    title += ["RESULT"] if results is not None else []
+    title[-1] += C_NORM
+    nt.add_row(title)
+    for (policy_name, node, cmd_name) in plan:
+        action = cmd_name.upper()
+        row = [policy_name, node.name, node.cloud,
+               C_STAT.get(node.state, C_NORM) + node.state + C_NORM,
+               C_STAT[action] + action + C_NORM]
+        if results is not None:
+            result = results.get(node.id, "-")
+            clr = {"done": C_GOOD, "timeout": C_WARN}.get(result, C_ERR)
+            row.append(clr + result + C_NORM)
+        nt.add_row(row)
+    nt.align = "l"
+    print(nt)
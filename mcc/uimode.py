@@ -23,18 +23,31 @@ Author:    Robert Peteuil
 
 """
 from __future__ import absolute_import, print_function
-from builtins import range
-from blessed import Terminal
-from mcc.confdir import CONFIG_DIR
-import sys
+import time
+import gevent
+import mcc.actionq as actionq
+import mcc.screen as screen
 from mcc.cldcnct import busy_disp_on, busy_disp_off
-from time import sleep
+from mcc.details import details_get
+from mcc.nodeidx import search_build, search_query
+from mcc.tables import details_table
+from mcc.sshexec import ssh_build_args, nodes_select, run_bulk
+from mcc.metrics import timed, counter_inc
 from mcc.colors import C_NORM, C_TI, C_GOOD, C_ERR, C_WARN, C_STAT, C_HEAD2
 from gevent import monkey
 from gevent import subprocess
 
 monkey.patch_all()
-term = Terminal()
+term = screen.term
+
+view_opts = {"query": ""}
+"""Display options changed by commands that only alter the display."""
+
+progress_layout = {}
+"""Frame lines of the displayed table, used to show action progress."""
+
+search_cache = {}
+"""Search index of the displayed node_dict, built on first search."""
 
 
 def ui_main(fmt_table, node_dict):
@@ -44,12 +57,20 @@ def ui_main(fmt_table, node_dict):
                  "stop": node_cmd,
                  "connect": node_cmd,
                  "details": node_cmd,
+                 "exec": cmd_exec,
+                 "filter": cmd_filter,
                  "update": True}
     ui_print("\033[?25l")  # cursor off
-    print("{}\n".format(fmt_table))
-    sys.stdout.flush()
+    lines = fmt_table.split("\n") + [""]
+    if view_opts["query"]:
+        filt_line = "{0}FILTER:{1} {2}".format(C_HEAD2, C_NORM,
+                                               view_opts["query"])
+        lines.extend([filt_line, ""])
+    screen.frame_draw(lines)  # only lines changed since last display sent
+    disp = progress_start(lines, node_dict)
     # refresh_main values:
     #   None = loop main-cmd, True = refresh-list, False = exit-program
+    #   "redraw" = display again without refreshing
     refresh_main = None
     while refresh_main is None:
         cmd_name = get_user_cmd(node_dict)
@@ -57,8 +78,10 @@ def ui_main(fmt_table, node_dict):
             refresh_main = cmd_funct[cmd_name](cmd_name, node_dict)
         else:
             refresh_main = cmd_funct[cmd_name]
-    if cmd_name != "connect" and refresh_main:
-        ui_clear(len(node_dict) + 2)
+        if refresh_main is False and not quit_confirm():
+            refresh_main = None
+    disp.kill()
+    screen.out_flush()
     return refresh_main
 
 
@@ -66,17 +89,17 @@ def get_user_cmd(node_dict):
     """Get main command selection."""
     key_lu = {"q": ["quit", True], "r": ["run", True],
               "s": ["stop", True], "u": ["update", True],
-              "c": ["connect", True], "d": ["details", True]}
+              "c": ["connect", True], "d": ["details", True],
+              "e": ["exec", True], "f": ["filter", True]}
     ui_cmd_bar()
     cmd_valid = False
-    input_flush()
     with term.cbreak():
         while not cmd_valid:
             val = input_by_key()
             cmd_name, cmd_valid = key_lu.get(val.lower(), ["invalid", False])
             if not cmd_valid:
                 ui_print(" - {0}Invalid Entry{1}".format(C_ERR, C_NORM))
-                sleep(0.5)
+                ui_pause(0.5)
                 ui_cmd_bar()
     return cmd_name
 
@@ -85,7 +108,7 @@ def node_cmd(cmd_name, node_dict):
     """Process commands that target specific nodes."""
     sc = {"run": cmd_startstop, "stop": cmd_startstop,
           "connect": cmd_connect, "details": cmd_details}
-    node_num = node_selection(cmd_name, len(node_dict))
+    node_num = node_selection(cmd_name, node_dict)
     refresh_main = None
     if node_num != 0:
         (node_valid, node_info) = node_validate(node_dict, node_num, cmd_name)
@@ -94,38 +117,105 @@ def node_cmd(cmd_name, node_dict):
             refresh_main = sub_cmd(node_dict[node_num], cmd_name, node_info)
         else:  # invalid target
             ui_print_suffix(node_info, C_ERR)
-            sleep(1.5)
+            ui_pause(1.5)
     else:  # '0' entered - exit command but not program
         ui_print(" - Exit Command")
-        sleep(0.5)
+        ui_pause(0.5)
     return refresh_main
 
 
-def node_selection(cmd_name, node_qty):
-    """Determine Node via alternate input method."""
+def node_selection(cmd_name, node_dict):
+    """Select node by number, or by searching name, IP, id or tags."""
     cmd_disp = cmd_name.upper()
-    cmd_title = ("\r{1}{0} NODE{2} - Enter {3}#{2}"
-                 " ({4}0 = Exit Command{2}): ".
+    cmd_title = ("\r{1}{0} NODE{2} - Enter {3}#{2} or {3}search{2}"
+                 " ({3}Tab{2} = next match, {4}0 = Exit Command{2}): ".
                  format(cmd_disp, C_TI, C_NORM, C_WARN, C_HEAD2))
     ui_cmd_title(cmd_title)
     selection_valid = False
-    input_flush()
-    with term.cbreak():
-        while not selection_valid:
-            node_num = input_by_key()
-            try:
-                node_num = int(node_num)
-            except ValueError:
-                node_num = 99999
-            if node_num <= node_qty:
-                selection_valid = True
-            else:
-                ui_print_suffix("Invalid Entry", C_ERR)
-                sleep(0.5)
-                ui_cmd_title(cmd_title)
+    while not selection_valid:
+        node_num = node_search(node_dict, screen.text_width(cmd_title))
+        if node_num is not None and 0 <= node_num <= len(node_dict):
+            selection_valid = True
+        else:
+            ui_print_suffix("Invalid Entry", C_ERR)
+            ui_pause(0.5)
+            ui_cmd_title(cmd_title)
     return node_num
 
 
+def node_search(node_dict, title_len):
+    """Read node number, or search text updating matches as it's typed.
+
+    The current match is shown after the input and marked in the table.
+    Tab or Down and Up move between matches, Enter selects.
+    """
+    usr_inp = ""
+    matches = []
+    pos = 0
+    with term.cbreak():
+        while True:
+            ui_print("\033[?25h")  # cursor on
+            screen.out_flush()
+            key_raw = term.inkey()
+            if key_raw.name == "KEY_ENTER":
+                break
+            state = search_key(key_raw, node_dict, usr_inp, matches, pos)
+            if state:
+                (usr_inp, matches, pos) = state
+                search_show(usr_inp, matches, pos, node_dict,
+                            term.width - title_len - len(usr_inp) - 1)
+    ui_print("\033[?25l")  # cursor off
+    search_show("", [], 0, node_dict, 0)
+    if usr_inp.strip().isdigit():
+        return int(usr_inp)
+    return matches[pos] if matches else None
+
+
+def search_key(key_raw, node_dict, usr_inp, matches, pos):
+    """Apply key to search, returning (input, matches, pos) or None.
+
+    None is returned for keys that are ignored.
+    """
+    if key_raw.name in ("KEY_TAB", "KEY_DOWN", "KEY_UP"):
+        step = -1 if key_raw.name == "KEY_UP" else 1
+        return usr_inp, matches, (pos + step) % len(matches) if matches else 0
+    if key_raw.name in ("KEY_DELETE", "KEY_BACKSPACE"):
+        ui_del_char(len(usr_inp))
+        usr_inp = usr_inp[:-1]
+    elif not key_raw.is_sequence:
+        usr_inp += key_raw
+        ui_print(key_raw)
+    else:
+        return None
+    return usr_inp, search_nodes(node_dict, usr_inp), 0
+
+
+def search_nodes(node_dict, usr_inp):
+    """Return node numbers matching search text, best first."""
+    if not usr_inp.strip() or usr_inp.strip().isdigit():
+        return []
+    if search_cache.get("node_dict") is not node_dict:
+        search_cache.update(node_dict=node_dict, index=search_build(node_dict))
+    return search_query(search_cache["index"], usr_inp)
+
+
+def search_show(usr_inp, matches, pos, node_dict, max_len):
+    """Show current match after input and mark its table row."""
+    if matches:
+        node = node_dict[matches[pos]]
+        hint = "  #{0} {1} ({2} {3}) [{4}/{5}]".format(
+            matches[pos], node.name, node.cloud, node.public_ips or "-",
+            pos + 1, len(matches))
+        progress_layout["marks"] = {matches[pos]: "{0}<- {1}{2}".format(
+            C_HEAD2, node.name, C_NORM)}
+    else:
+        hint = "  no match" if usr_inp.strip() and not usr_inp.strip().isdigit() else ""
+        progress_layout["marks"] = {}
+    hint = "{0}{1}{2}".format(C_HEAD2, hint[:max(max_len, 0)], C_NORM)
+    ui_print(term.save + term.clear_eol + hint + term.restore)
+    progress_draw()
+
+
 def node_validate(node_dict, node_num, cmd_name):
     """Validate that command can be performed on target node."""
     # cmd: [required-state, action-to-displayed, error-statement]
@@ -140,46 +230,27 @@ def node_validate(node_dict, node_num, cmd_name):
           False: req_lu[cmd_name][1]}
     node_valid = bool(req_lu[cmd_name][0] == node_dict[node_num].state)
     node_info = tm[node_valid]
+    if cmd_name in ("run", "stop") and actionq.action_pending(node_dict[node_num]):
+        (node_valid, node_info) = (False, "Action Already In Progress")
     return node_valid, node_info
 
 
 def cmd_startstop(node, cmd_name, node_info):
-    """Confirm command and execute it."""
-    cmd_lu = {"run": ["ex_start_node", "wait_until_running", "RUNNING"],
-              "stop": ["ex_stop_node", "", "STOPPING"]}
-    # specific delay & message {provider: {command: [delay, message]}}
-    cld_lu = {"azure": {"stop": [6, "Initiated"]},
-              "aws": {"stop": [6, "Initiated"]}}
+    """Confirm command and queue it to run in the background.
+
+    Progress is shown in the node's table row, so more commands can be
+    entered while it runs.
+    """
     conf_mess = ("\r{0}{1}{2} {3} - Confirm [y/N]: ".
                  format(C_STAT[cmd_name.upper()], cmd_name.upper(), C_NORM,
                         node_info))
-    cmd_result = None
     if input_yn(conf_mess):
-        exec_mess = ("\r{0}{1}{2} {3}:  ".
-                     format(C_STAT[cmd_name.upper()], cmd_lu[cmd_name][2],
-                            C_NORM, node_info))
-        ui_erase_ln()
-        ui_print(exec_mess)
-        busy_obj = busy_disp_on()  # busy indicator ON
-        node_drv = getattr(node, "driver")
-        main_cmd = getattr(node_drv, cmd_lu[cmd_name][0])
-        response = main_cmd(node)  # noqa
-        cmd_wait = cmd_lu[cmd_name][1]
-        if cmd_wait:
-            seccmd = getattr(node_drv, cmd_wait)
-            response = seccmd([node])  # noqa
-        delay, cmd_end = cld_lu.get(node.cloud,
-                                    {}).get(cmd_name, [0, "Successful"])
-        sleep(delay)
-        busy_disp_off(busy_obj)  # busy indicator OFF
-        ui_print("\033[D")  # remove extra space
-        cmd_result = True
-        ui_print_suffix("{0} {1}".format(cmd_name.title(), cmd_end), C_GOOD)
-        sleep(1.5)
+        actionq.action_queue(node, cmd_name)
+        ui_print_suffix("{0} Queued".format(cmd_name.title()), C_GOOD)
     else:
         ui_print_suffix("Command Aborted")
-        sleep(0.75)
-    return cmd_result
+    ui_pause(0.75)
+    return None
 
 
 def cmd_connect(node, cmd_name, node_info):
@@ -196,67 +267,183 @@ def cmd_connect(node, cmd_name, node_info):
                             conn_info, C_HEAD2))
         ui_erase_ln()
         ui_print(exec_mess)
-        (ssh_user, ssh_key) = ssh_get_info(node)
-        if ssh_user:
-            ssh_cmd = "ssh {0}{1}@{2}".format(ssh_key, ssh_user,
-                                              node.public_ips)
-        else:
-            ssh_cmd = "ssh {0}{1}".format(ssh_key, node.public_ips)
-        print("\n")
-        ui_print("\033[?25h")  # cursor on
-        subprocess.call(ssh_cmd, shell=True)
-        ui_print("\033[?25l")  # cursor off
-        print()
+        ssh_args = ssh_build_args(node)
+        progress_layout.clear()  # table scrolls, stop progress display
+        screen.frame_reset()
+        ui_print("\n\n\033[?25h")  # cursor on
+        screen.out_flush()
+        ssh_rc = subprocess.call(ssh_args)
+        counter_inc("mcc_actions_total", cloud=node.cloud, action="connect",
+                    result="failed" if ssh_rc == 255 else "ok")
+        ui_print("\033[?25l\n")  # cursor off
         cmd_result = True
     else:
         ui_print_suffix("Command Aborted")
-        sleep(0.75)
+        ui_pause(0.75)
     return cmd_result
 
 
-def cmd_details(node, cmd_name, node_info):
-    """Display Node details."""
-    ui_print_suffix("Command Aborted")
-    return None
+def cmd_exec(cmd_name, node_dict):
+    """Execute shell command on multiple nodes via ssh."""
+    sel_title = ("\r{0}{1} ON NODES{2} - Enter {3}#s{2}, {3}ranges{2},"
+                 " {3}all{2} or {3}key=value{2} ({4}blank = Exit Command{2}): ".
+                 format(C_TI, cmd_name.upper(), C_NORM, C_WARN, C_HEAD2))
+    ui_cmd_title(sel_title)
+    try:
+        node_nums = nodes_select(node_dict, input_by_key())
+    except ValueError as e:
+        ui_print_suffix("Invalid Selection '{0}'".format(e))
+        ui_pause(0.75)
+        return None
+    if not node_nums:
+        ui_print_suffix("No Nodes Selected")
+        ui_pause(0.75)
+        return None
+    ui_cmd_title("\r{0}COMMAND{1} for {2}{3}{1} node(s): ".
+                 format(C_TI, C_NORM, C_WARN, len(node_nums)))
+    command = input_by_key()
+    conf_mess = ("\r{0}EXEC{1} '{2}' on {3}{4}{1} node(s) - Confirm [y/N]: ".
+                 format(C_STAT[cmd_name.upper()], C_NORM, command, C_WARN,
+                        len(node_nums)))
+    cmd_result = None
+    if command and input_yn(conf_mess):
+        progress_layout.clear()  # table scrolls, stop progress display
+        screen.frame_reset()
+        ui_print("\n\n")
+        screen.out_flush()
+        nodes = [node_dict[x] for x in node_nums]
+        with timed("mcc_action_seconds", cloud="all", action="exec"):
+            results = run_bulk(nodes, command)
+        for (node, exit_code) in results:
+            counter_inc("mcc_actions_total", cloud=node.cloud,
+                        action="exec", result="failed" if exit_code else "ok")
+        ui_print("\nPress any key to continue")
+        screen.out_flush()
+        with term.cbreak():
+            input_flush()
+            term.inkey()
+        ui_print("\n")
+        cmd_result = True
+    else:
+        ui_print_suffix("Command Aborted")
+        ui_pause(0.75)
+    return cmd_result
+
 
+def cmd_filter(cmd_name, node_dict):
+    """Set query used to filter displayed nodes."""
+    filt_title = ("\r{0}FILTER{1} - Enter {2}key=value{1} terms,"
+                  " e.g. {2}state=running env=prod{1}"
+                  " ({3}blank = Show All{1}): ".
+                  format(C_TI, C_NORM, C_WARN, C_HEAD2))
+    ui_cmd_title(filt_title)
+    view_opts["query"] = input_by_key().strip()
+    return "redraw"
 
-def ssh_get_info(node):
-    """Determine ssh-user and ssh-key for node."""
-    ssh_key = ""
-    if node.cloud == "aws":
-        raw_key = node.extra['key_name']
-        ssh_key = "-i {0}{1}.pem ".format(CONFIG_DIR, raw_key)
-        ssh_user = ssh_calc_aws(node)
-    elif node.cloud == "azure":
-        ssh_user = node.extra['properties']['osProfile']['adminUsername']
-    elif node.cloud == "gcp":
-        items = node.extra['metadata'].get('items', [{}])
-        keyname = items['key' == 'ssh-keys'].get('value', "")
-        pos = keyname.find(":")
-        ssh_user = keyname[0:pos]
-    elif node.cloud == "alicloud":
-        ssh_user = ""
-    return ssh_user, ssh_key
-
-
-def ssh_calc_aws(node):
-    """Calculate default ssh-user based on image-if of AWS instance."""
-    userlu = {"ubunt": "ubuntu", "debia": "admin", "fedor": "root",
-              "cento": "centos", "openb": "root"}
-    image_name = node.driver.get_image(node.extra['image_id']).name
-    if not image_name:
-        image_name = node.name
-    usertemp = ['name'] + [value for key, value in list(userlu.items())
-                           if key in image_name.lower()]
-    usertemp = dict(zip(usertemp[::2], usertemp[1::2]))
-    username = usertemp.get('name', 'ec2-user')
-    return username
+
+def cmd_details(node, cmd_name, node_info):
+    """Display node details, fetching them when first requested."""
+    ui_erase_ln()
+    exec_mess = ("\r{0}DETAILS{1} {2}:  ".
+                 format(C_STAT[cmd_name.upper()], C_NORM, node_info))
+    ui_print(exec_mess)
+    screen.out_flush()
+    busy_obj = busy_disp_on()  # busy indicator ON
+    (sections, cached) = details_get(node)
+    busy_disp_off(busy_obj)  # busy indicator OFF
+    progress_layout.clear()  # table scrolls, stop progress display
+    screen.frame_reset()
+    ui_print("\n\n")
+    screen.out_flush()
+    details_table(sections)
+    if cached:
+        ui_print("\n{0}Cached details, updated when node state changes{1}".
+                 format(C_HEAD2, C_NORM))
+    ui_print("\nPress any key to continue")
+    screen.out_flush()
+    with term.cbreak():
+        input_flush()
+        term.inkey()
+    ui_print("\n")
+    return "redraw"
+
+
+def quit_confirm():
+    """Confirm quitting if actions are still in progress."""
+    pending = actionq.pending_count()
+    if not pending:
+        return True
+    conf_mess = ("\r{0}{1}{2} action(s) still in progress - Quit anyway"
+                 " [y/N]: ".format(C_WARN, pending, C_NORM))
+    return input_yn(conf_mess)
+
+
+def progress_start(lines, node_dict):
+    """Record table layout and start displaying action progress."""
+    widths = [screen.text_width(x) for x in lines]
+    progress_layout.clear()
+    progress_layout.update(lines=lines, widths=widths, col=max(widths) + 3,
+                           rows={node.id: num for num, node in
+                                 node_dict.items()})
+    return gevent.spawn(progress_display)
+
+
+def progress_display():
+    """Show status of queued actions beside their table rows."""
+    while True:
+        progress_draw()
+        gevent.sleep(0.5)
+
+
+def progress_draw():
+    """Draw action progress and search marks beside table rows.
+
+    The frame is updated with keep_cursor, so only rows whose text
+    changed are sent and input on the command line is not disturbed.
+    """
+    if not progress_layout:
+        return
+    marks = dict(progress_layout.get("marks", {}))
+    col = progress_layout["col"]
+    for node_id, action in actionq.actions.items():
+        row = progress_layout["rows"].get(node_id)
+        if row is not None:
+            marks[row] = progress_text(action, term.width - col)
+    if not marks and not progress_layout.get("marked"):
+        return
+    lines = list(progress_layout["lines"])
+    for row, text in marks.items():
+        pad = " " * (col - progress_layout["widths"][row])
+        lines[row] += pad + text
+    progress_layout["marked"] = bool(marks)
+    screen.frame_draw(lines, keep_cursor=True)
+    screen.out_flush()
+
+
+def progress_text(action, max_len):
+    """Return colored progress text for action, truncated to max_len."""
+    status = action["status"]
+    elapsed = int((action["end"] or time.time()) - action["start"])
+    if status == "waiting":
+        detail = "{0} {1}s".format(action["node"].state, elapsed)
+    elif status == "failed":
+        detail = action["error"]
+    elif status == "timeout":
+        detail = "timed out {0}s".format(elapsed)
+    else:
+        detail = "{0} {1}s".format(status, elapsed)
+    text = u"<- {0} {1}".format(action["cmd"].upper(), detail)[:max(max_len - 1, 0)]
+    clr = {"done": C_GOOD, "failed": C_ERR, "timeout": C_ERR}.get(status, C_WARN)
+    return u"{0}{1}{2}".format(clr, text, C_NORM) if text else ""
 
 
 def ui_print(to_print):
-    """Print text without carriage return."""
-    sys.stdout.write(to_print)
-    sys.stdout.flush()
+    """Print text without carriage return.
+
+    Output is buffered until input is read or a pause begins, so each
+    interaction is sent in one write.
+    """
+    screen.line_write(to_print)
 
 
 def ui_print_suffix(to_print, clr=C_WARN):
@@ -272,37 +459,33 @@ def ui_cmd_title(cmd_title):
 
 def ui_cmd_bar():
     """Display Command Bar."""
-    cmd_bar = ("\rSELECT COMMAND -  {2}(R){1}un   {0}(C){1}onnect   "
-               "{3}(S){1}top   {0}(U){1}pdate"
-               "   {0}(Q){1}uit: ".
-               format(C_TI, C_NORM, C_GOOD, C_ERR))
-    # FUTURE - TO BE USED WHEN DETAILS IMPLEMENTED
-    # cmd_bar = ("\rSELECT COMMAND -  {2}(R){1}un   {0}(C){1}onnect   "
-    #            "{3}(S){1}top   {0}(D){1}etails   {0}(U){1}pdate Info"
-    #            "   {4}(Q){1}uit: ".
-    #            format(C_TI, C_NORM, C_GOOD, C_ERR, C_HEAD2))
+    # fits 80 columns, a wrapped bar isn't fully erased by ui_erase_ln
+    cmd_bar = ("\rCOMMAND - {2}(R){1}un {0}(C){1}onnect {3}(S){1}top"
+               " {0}(D){1}etails {0}(E){1}xec {0}(F){1}ilter {0}(U){1}pdate"
+               " {0}(Q){1}uit: ".format(C_TI, C_NORM, C_GOOD, C_ERR))
     ui_erase_ln()
     ui_print(cmd_bar)
 
 
+def ui_pause(delay):
+    """Pause so message can be read, return early if a key is pressed.
+
+    The key is left in the input buffer for the next command.
+    """
+    screen.out_flush()
+    with term.cbreak():
+        term.kbhit(timeout=delay)
+
+
 def ui_del_char(check_len):
     """Move Left and delete one character."""
     if check_len:
         ui_print("\033[D \033[D")
 
 
-def ui_clear(num_lines):
-    """Clear previous display info from screen in prep for new data."""
-    ui_erase_ln()
-    for i in range(num_lines, 0, -1):
-        ui_print("\033[A")
-        ui_erase_ln()
-
-
 def ui_erase_ln():
-    """Erase line above and position cursor on that line."""
-    blank_ln = " " * (term.width - 1)
-    ui_print("\r{0}".format(blank_ln))
+    """Erase line and position cursor at its start."""
+    screen.erase_ln()
 
 
 def input_flush():
@@ -320,16 +503,16 @@ def input_by_key():
     """Get user input using term.inkey to prevent /n printing at end."""
     usr_inp = ''
     input_valid = True
-    input_flush()
     with term.cbreak():
         while input_valid:
             ui_print("\033[?25h")  # cursor on
+            screen.out_flush()
             key_raw = term.inkey()
             if key_raw.name == "KEY_ENTER":
                 input_valid = False
                 ui_print("\033[?25l")  # cursor off
                 break
-            if key_raw.name == 'KEY_DELETE':
+            if key_raw.name in ("KEY_DELETE", "KEY_BACKSPACE"):
                 ui_del_char(len(usr_inp))
                 usr_inp = usr_inp[:-1]
             if not key_raw.is_sequence:
@@ -0,0 +1,156 @@
+"""Wait for nodes to reach a target state with adaptive polling.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from gevent.pool import Group
+from libcloud.common.exceptions import BaseHTTPError
+from mcc.providers import prov_get, node_prov
+import gevent
+import time
+
+TARGET_LU = {"run": [("running",), False],
+             "stop": [("stopped", "terminated"), False],
+             "terminate": [("terminated",), False],
+             "reboot": [("running",), True]}
+"""Completion states per command: [target-states, must-leave-target].
+
+Commands with must-leave-target set only complete after the node has
+been observed outside the target states (or remained in them for
+REBOOT_POLLS polls, as some providers reboot without a state change).
+"""
+
+REBOOT_POLLS = 3
+WAIT_TIMEOUT = 600
+
+
+def wait_add(pending, sched, nodes, cmd_name, timeout=WAIT_TIMEOUT):
+    """Add nodes to pending, a dict of node-id: wait-item.
+
+    sched holds the poll schedule per cloud, clouds of added nodes are
+    re-scheduled at their initial interval.
+    """
+    deadline = time.time() + timeout
+    must_leave = TARGET_LU[cmd_name][1]
+    for node in nodes:
+        pending[node.id] = {"node": node, "cmd": cmd_name, "polls": 0,
+                            "left": not must_leave, "deadline": deadline}
+        interval = poll_param(node.cloud)[0]
+        sched[node.cloud] = [interval, time.time() + interval]
+
+
+def wait_poll(pending, sched, wake=None):
+    """Wait for the next poll, then poll nodes of clouds due.
+
+    Returns {node-id: final-state} for nodes that completed or timed
+    out, these are removed from pending.  Setting the optional wake
+    event ends the wait early, after nodes are added.
+    """
+    due = sched_wait(pending, sched, wake)
+    states = poll_states([x["node"] for x in pending.values()
+                         if x["node"].cloud in due])
+    results = wait_eval(pending, states)
+    for node_id in results:
+        del pending[node_id]
+    for cloud in due:
+        sched_next(sched, cloud)
+    return results
+
+
+def wait_eval(pending, states):
+    """Return {node-id: final-state} of pending nodes complete or expired."""
+    results = {k: v for k, v in states.items()
+               if k in pending and wait_check(pending[k], v)}
+    now = time.time()
+    results.update((k, "timeout") for k, v in pending.items()
+                   if k not in results and v["deadline"] <= now)
+    return results
+
+
+def wait_check(item, state):
+    """Record state polled for wait-item, return True if it's complete."""
+    targets = TARGET_LU[item["cmd"]][0]
+    item["node"].state = state
+    item["polls"] += 1
+    if state not in targets:
+        item["left"] = True
+        return False
+    return item["left"] or item["polls"] >= REBOOT_POLLS
+
+
+def sched_wait(pending, sched, wake=None):
+    """Sleep until a cloud's poll or a deadline is due, return clouds due."""
+    clouds = set(x["node"].cloud for x in pending.values())
+    times = [sched[x][1] for x in clouds]
+    times.extend(x["deadline"] for x in pending.values())
+    due_time = min(times)
+    if wake is None:
+        gevent.sleep(max(due_time - time.time(), 0))
+    else:
+        wake.wait(max(due_time - time.time(), 0))
+        wake.clear()
+    return [x for x in clouds if sched[x][1] <= time.time()]
+
+
+def sched_next(sched, cloud):
+    """Increase cloud's poll interval and schedule its next poll."""
+    (unused, factor, maximum) = poll_param(cloud)
+    interval = min(sched[cloud][0] * factor, maximum)
+    sched[cloud] = [interval, time.time() + interval]
+
+
+def poll_param(cloud):
+    """Return poll interval parameters for provider."""
+    return getattr(prov_get(cloud), "POLL", [2.0, 1.5, 15.0])
+
+
+def poll_states(nodes):
+    """Get current state of nodes with one list request per connection."""
+    by_driver = {}
+    for node in nodes:
+        by_driver.setdefault(node.driver, []).append(node)
+    pgroup = Group()
+    state_lists = pgroup.map(lambda item: list_states(*item),
+                             by_driver.items())
+    states = {}
+    for item in state_lists:
+        states.update(item)
+    return states
+
+
+def list_states(driver, nodes):
+    """List node states for one connection, limiting to node ids if able.
+
+    Nodes missing from a successful listing have been deleted and are
+    reported as terminated.
+    """
+    node_ids = [node.id for node in nodes]
+    list_args = node_prov(nodes[0]).list_args(node_ids)
+    try:
+        listed = driver.list_nodes(**list_args)
+    except BaseHTTPError:
+        return {}
+    states = dict.fromkeys(node_ids, "terminated")
+    states.update((node.id, node.state) for node in listed
+                  if node.id in states)
+    return states
@@ -0,0 +1,115 @@
+"""Track node changes between refreshes and draw the watch mode table.
+
+License:
+
+    MCC - Command-Line Instance Control for AWS, Azure, GCP and AliCloud.
+    Copyright (C) 2017-2018  Robert Peteuil
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+URL:       https://github.com/robertpeteuil/multi-cloud-control
+Author:    Robert Peteuil
+
+"""
+from __future__ import absolute_import, print_function
+from datetime import datetime
+from mcc.colors import C_NORM, C_WARN, C_ERR
+from mcc.tables import indx_table
+import mcc.screen as screen
+import gevent
+import random
+import time
+
+MARK_SECS = 300
+"""Seconds a node's state change stays marked beside its row."""
+
+JITTER = 0.1
+"""Refresh intervals vary randomly by up to this fraction, so watchers
+started together don't send their requests at the same time."""
+
+
+def changes_track(seen, node_dict, now):
+    """Update seen from node_dict and return (changed, added, removed).
+
+    seen is {(cloud, node-id): [state, change-time, previous-state]},
+    previous-state is "new" for nodes added since the first refresh.
+    """
+    first = not seen
+    current = {}
+    (changed, added) = (0, 0)
+    for node in node_dict.values():
+        key = (node.cloud, node.id)
+        item = seen.get(key)
+        if item is None:
+            item = [node.state, None, None] if first else [node.state, now, "new"]
+            added += not first
+        elif item[0] != node.state:
+            item = [node.state, now, item[0]]
+            changed += 1
+        current[key] = item
+    removed = len(set(seen) - set(current))
+    seen.clear()
+    seen.update(current)
+    return changed, added, removed
+
+
+def watch_lines(node_dict, seen, status, now):
+    """Return table lines with recent changes marked, then status lines."""
+    lines = indx_table(node_dict, ret=True).split("\n")
+    col = max(screen.text_width(x) for x in lines) + 3
+    max_len = screen.term.width - col - 1
+    for row, node in enumerate(node_dict.values(), 1):
+        (unused, changed, previous) = seen[(node.cloud, node.id)]
+        if changed is None or now - changed > MARK_SECS:
+            continue
+        when = datetime.fromtimestamp(changed).strftime("%H:%M:%S")
+        text = (u"<- new {0}" if previous == "new" else
+                u"<- {1} {0}").format(when, previous)[:max(max_len, 0)]
+        if text:
+            pad = " " * (col - screen.text_width(lines[row]))
+            lines[row] += u"{0}{1}{2}{3}".format(pad, C_WARN, text, C_NORM)
+    return lines + [""] + status
+
+
+def watch_status(interval, counts, now, errors):
+    """Return status lines for refresh at time now.
+
+    Providers that failed to refresh are listed, their nodes are shown
+    as previously collected.
+    """
+    lines = ["Updated {0}: {1} changed, {2} added, {3} removed - refresh"
+             " every {4:g}s, Ctrl-C to exit".format(
+                 datetime.fromtimestamp(now).strftime("%H:%M:%S"),
+                 counts[0], counts[1], counts[2], interval)]
+    for crid in sorted(errors):
+        text = u"{0} refresh failed, showing earlier data: {1}".format(
+            crid, errors[crid])
+        lines.append(u"{0}{1}{2}".format(
+            C_ERR, text[:max(screen.term.width - 1, 0)], C_NORM))
+    return lines
+
+
+def watch_sleep(interval):
+    """Sleep until the next refresh, interval varied by JITTER."""
+    jitter = random.uniform(1 - JITTER, 1 + JITTER)  # nosec - not security
+    gevent.sleep(interval * jitter)
+
+
+def watch_draw(node_dict, seen, interval, errors=None):
+    """Record changes in node_dict and redraw rows that changed."""
+    now = time.time()
+    counts = changes_track(seen, node_dict, now)
+    status = watch_status(interval, counts, now, errors or {})
+    screen.frame_draw(watch_lines(node_dict, seen, status, now))
+    screen.out_flush()
@@ -40,7 +40,8 @@ EXTRAS_REQUIRE = {
     ],
     ":python_full_version>='2.7.9'": [
         "requests >= 2.5.1"
-    ]
+    ],
+    "redis": ["redis >= 2.10.0"]
 }
 
 if int(setuptools.__version__.split(".", 1)[0]) < 18:
@@ -61,8 +62,8 @@ if int(setuptools.__version__.split(".", 1)[0]) < 18:
 
 setup(
     name='mcc',
-    packages=['mcc'],
-    package_data={'mcc': ['config.ini']},
+    packages=['mcc', 'mcc.providers'],
+    package_data={'mcc': ['config.ini', 'catalog.json']},
     entry_points={'console_scripts': ['mcc=mcc.core:main',
                                       'mccl=mcc.core:list_only']},
     version='0.9.8',